@@ -1,20 +1,32 @@
 import os
+import time
+import functools
 import tempfile
 import numpy as np
 import pandas as pd
 import streamlit as st
-import faiss, joblib
-import librosa
-import soundfile as sf
-from features.extract_features import extract_features
+import joblib
+from features.backends import artifact_paths, get_backend
+from models.projection import load_projection, transform_vectors
+from models.similarity_search import load_index
+from query_backend import QueryBackend, QueueFullError
 
 PROCESSED_DIR = "data/processed"
-INDEX_FILE = "models/faiss_index.bin"
-SCALER_FILE = "models/feature_scaler.pkl"
-MAPPING_FILE = os.path.join(PROCESSED_DIR, "index_mapping.csv")
+
+# Feature backend (VYBE_BACKEND) decides which index and scaler are loaded
+BACKEND = get_backend()
+PATHS = artifact_paths(BACKEND, PROCESSED_DIR)
+INDEX_FILE = PATHS["index"]
+SCALER_FILE = PATHS["scaler"]
+PROJECTION_FILE = PATHS["projection"]
+MAPPING_FILE = PATHS["mapping"]
 LIBRARY_FILE = os.path.join(PROCESSED_DIR, "library.csv")
 
-CLIP_DURATION = 30.0
+# Memory-map the index so several worker processes share one copy (set VYBE_MMAP_INDEX=0 to disable)
+MMAP_INDEX = os.environ.get("VYBE_MMAP_INDEX", "1") != "0"
+
+# Worker processes for decode/extract, shared by every session on this server
+EXTRACT_WORKERS = int(os.environ.get("VYBE_EXTRACT_WORKERS", "0")) or None
 
 
 def lookup_track_by_filename(filename: str, lib: pd.DataFrame):
@@ -28,97 +40,58 @@ def lookup_track_by_filename(filename: str, lib: pd.DataFrame):
     return tid, row["display"]
 
 
-def select_smart_clip_to_path(query_path: str, out_path: str, duration: float = CLIP_DURATION) -> str:
-    y, sr = librosa.load(query_path, sr=None, mono=True)
-
-    total_len_sec = len(y) / sr
-    if total_len_sec <= duration:
-        sf.write(out_path, y, sr)
-        return out_path
-
-    hop_length = 512
-    frame_length = 2048
-    rms = librosa.feature.rms(
-        y=y,
-        frame_length=frame_length,
-        hop_length=hop_length
-    )[0]
-
-    frames = np.arange(len(rms))
-    times = librosa.frames_to_time(frames, sr=sr, hop_length=hop_length)
-
-    window_frames = int((duration * sr) / hop_length)
-    if window_frames <= 0 or window_frames > len(rms):
-        offset = max(0.0, (total_len_sec - duration) / 2.0)
-    else:
-        avg_rms = np.convolve(rms, np.ones(window_frames), mode="valid") / window_frames
-        best_frame = int(np.argmax(avg_rms))
-        offset = float(times[best_frame])
-        if offset + duration > total_len_sec:
-            offset = max(0.0, total_len_sec - duration)
-
-    y_clip, _ = librosa.load(query_path, sr=sr, mono=True, offset=offset, duration=duration)
-    sf.write(out_path, y_clip, sr)
-    return out_path
-
-
 @st.cache_resource
 def load_assets():
     for path in [INDEX_FILE, SCALER_FILE, MAPPING_FILE, LIBRARY_FILE]:
         if not os.path.exists(path):
             raise FileNotFoundError(f"Missing required file: {path}")
 
-    index = faiss.read_index(INDEX_FILE)
+    index = load_index(INDEX_FILE, mmap=MMAP_INDEX)
     scaler = joblib.load(SCALER_FILE)
+    projection = load_projection(PROJECTION_FILE)
     mapping = pd.read_csv(MAPPING_FILE)
     lib = pd.read_csv(LIBRARY_FILE)
 
-    return index, scaler, mapping, lib
+    return index, scaler, projection, mapping, lib
 
 
-def search_similar(query_audio_path: str, k: int = 11, top_n: int = 5):
-    index, scaler, mapping, lib = load_assets()
+# Scales, normalizes and searches one extracted feature vector. Runs on the
+# backend's search threads, where FAISS releases the GIL.
+def search_vector(q_vec: np.ndarray, k: int = 11, top_n: int = 5, assets=None):
+    index, scaler, projection, mapping, lib = assets or load_assets()
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_clip:
-        clip_path = tmp_clip.name
+    q_vec = transform_vectors(q_vec, scaler, projection)
 
-    try:
-        select_smart_clip_to_path(query_audio_path, clip_path, duration=CLIP_DURATION)
-
-        q_vec = extract_features(clip_path)
-        if not isinstance(q_vec, np.ndarray) or q_vec.size == 0:
-            return []
-
-        q_vec = q_vec.astype("float32").reshape(1, -1)
-        q_vec = scaler.transform(q_vec).astype("float32")
-        faiss.normalize_L2(q_vec)
-
-        D, I = index.search(q_vec, k)
-
-        results = []
-        shown = 0
-        for idx, score in zip(I[0], D[0]):
-            hit = mapping.loc[mapping["index_pos"] == idx]
-            if hit.empty:
-                continue
-            fname = hit.iloc[0]["filename"]
-            tid, disp = lookup_track_by_filename(fname, lib)
-            results.append({
-                "rank": shown + 1,
-                "track_id": tid,
-                "display": disp,
-                "similarity": float(score),
-                "filename": fname
-            })
-            shown += 1
-            if shown >= top_n:
-                break
-
-        return results
-
-    finally:
-        if os.path.exists(clip_path):
-            os.remove(clip_path)
+    D, I = index.search(q_vec, k)
+
+    results = []
+    shown = 0
+    for idx, score in zip(I[0], D[0]):
+        hit = mapping.loc[mapping["index_pos"] == idx]
+        if hit.empty:
+            continue
+        fname = hit.iloc[0]["filename"]
+        tid, disp = lookup_track_by_filename(fname, lib)
+        results.append({
+            "rank": shown + 1,
+            "track_id": tid,
+            "display": disp,
+            "similarity": float(score),
+            "filename": fname
+        })
+        shown += 1
+        if shown >= top_n:
+            break
+
+    return results
+
+
+# One backend per server process, so every session shares the same pools.
+# Assets are bound here because the search threads run outside Streamlit's script context.
+@st.cache_resource
+def get_query_backend():
+    return QueryBackend(functools.partial(search_vector, assets=load_assets()),
+                        workers=EXTRACT_WORKERS, backend_name=BACKEND.name)
 
 
 # Streamlit UI
@@ -146,9 +119,28 @@ with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_in:
     tmp_in.write(uploaded.getbuffer())
     query_path = tmp_in.name
 
+# The backend owns the upload from here and deletes it once no worker can be reading it
+future = None
 try:
+    backend = get_query_backend()
+    future = backend.submit(query_path, k=k, top_n=top_n, delete_input=True)
+
+    # poll instead of blocking so the page keeps updating while workers are busy
+    status = st.empty()
     with st.spinner("Searching..."):
-        results = search_similar(query_path, k=k, top_n=top_n)
+        while not future.done():
+            status.caption(f"{backend.running} running, {max(backend.pending - backend.running, 0)} queued on this server")
+            time.sleep(0.2)
+    status.empty()
+
+    try:
+        results = future.result()
+    except QueueFullError as e:
+        st.warning(str(e))
+        st.stop()
+    except TimeoutError:
+        st.error("Search timed out. Try a shorter file or try again in a moment.")
+        st.stop()
 
     if not results:
         st.error("Could not extract features from this file. Try a different audio file/format.")
@@ -160,5 +152,9 @@ try:
         st.write(f"**{r['rank']}.** ID {tid} | {r['display']}  \nSimilarity: `{r['similarity']:.3f}`")
 
 finally:
-    if os.path.exists(query_path):
-        os.remove(query_path)
+    if future is None:
+        if os.path.exists(query_path):
+            os.remove(query_path)
+    elif not future.done():
+        # a rerun interrupted the poll, so nobody will read this result
+        future.cancel()
@@ -0,0 +1,235 @@
+"""
+Feature backends that turn an audio file into the vector we index.
+
+Each backend has a name and a version. Together they tag the cached feature
+files and the index artifacts, so indexes for different backends (or for an
+older version of the same backend) can live side by side. The backend used by
+prep_data.py, utils/new_index.py, search.py and demo.py is picked with the
+VYBE_BACKEND environment variable and defaults to the original MFCC/chroma vector.
+"""
+
+import os
+
+import librosa
+import numpy as np
+
+from features.extract_features import extract_features, extract_features_many
+
+DEFAULT_BACKEND = os.environ.get("VYBE_BACKEND", "mfcc")
+
+PROCESSED_DIR = "data/processed"
+MODELS_DIR = "models"
+
+
+class FeatureBackend:
+    name = ""
+    version = ""
+    dim = 0
+
+    # e.g. "openl3-v1", used to tag cached features and index files
+    @property
+    def tag(self) -> str:
+        return f"{self.name}-v{self.version}"
+
+    # Returns one feature vector, or an empty array if the file can't be used
+    def extract(self, file_path: str) -> np.ndarray:
+        raise NotImplementedError
+
+    # Returns a list aligned with file_paths, with empty arrays for failures
+    def extract_many(self, file_paths) -> list:
+        return [self.extract(p) for p in file_paths]
+
+
+# The original 64-dim tempo/MFCC/chroma/contrast/tonnetz vector
+class MfccBackend(FeatureBackend):
+    name = "mfcc"
+    version = "1"
+    dim = 64
+
+    def __init__(self, batch_size: int = 32, workers: int = None):
+        self.batch_size = batch_size
+        self.workers = workers
+
+    def extract(self, file_path: str) -> np.ndarray:
+        return extract_features(file_path)
+
+    def extract_many(self, file_paths) -> list:
+        return extract_features_many(file_paths, batch_size=self.batch_size, workers=self.workers)
+
+
+# Mean-pooled OpenL3 embedding of the centre 30 s of each clip, as in openl3_testing.py.
+# The model is loaded once per process and frames from many clips go through
+# each inference call together.
+class OpenL3Backend(FeatureBackend):
+    name = "openl3"
+    version = "1"
+    sample_rate = 48000  # OpenL3's native rate, so it never has to resample
+
+    def __init__(self, embedding_size: int = 512, content_type: str = "music",
+                 input_repr: str = "mel256", hop_size: float = 0.5,
+                 duration: float = 30.0, batch_size: int = 256, clips_per_call: int = 16):
+        self.dim = embedding_size
+        self.content_type = content_type
+        self.input_repr = input_repr
+        self.hop_size = hop_size
+        self.duration = duration
+        self.batch_size = batch_size  # frames per model.predict batch
+        self.clips_per_call = clips_per_call
+        self._model = None
+
+    @property
+    def tag(self) -> str:
+        return f"{self.name}-{self.input_repr}-{self.content_type}-{self.dim}-v{self.version}"
+
+    @property
+    def model(self):
+        if self._model is None:
+            try:
+                import openl3
+            except ImportError as e:
+                raise ImportError("The openl3 backend needs the openl3 package (pip install openl3)") from e
+            self._model = openl3.models.load_audio_embedding_model(
+                input_repr=self.input_repr,
+                content_type=self.content_type,
+                embedding_size=self.dim,
+            )
+        return self._model
+
+    def _load_clip(self, path: str):
+        try:
+            y, _ = librosa.load(path, sr=self.sample_rate, mono=True)
+        except Exception as e:
+            print(f"Failed to process {path}: {e}")
+            return None
+        if y is None or len(y) < self.sample_rate / 2:
+            print(f"[WARN] {path} too short or unreadable, skipping.")
+            return None
+
+        n = int(self.duration * self.sample_rate)
+        if self.duration and len(y) > n:
+            # center crop
+            start = (len(y) - n) // 2
+            y = y[start:start + n]
+        return y
+
+    def extract(self, file_path: str) -> np.ndarray:
+        return self.extract_many([file_path])[0]
+
+    def extract_many(self, file_paths) -> list:
+        import openl3
+
+        file_paths = list(file_paths)
+        results = [np.array([])] * len(file_paths)
+
+        for start in range(0, len(file_paths), self.clips_per_call):
+            chunk = range(start, min(start + self.clips_per_call, len(file_paths)))
+            clips = [(i, self._load_clip(file_paths[i])) for i in chunk]
+            clips = [(i, y) for i, y in clips if y is not None]
+            if not clips:
+                continue
+
+            embeddings, _ = openl3.get_audio_embedding(
+                [y for _, y in clips], self.sample_rate,
+                model=self.model,
+                hop_size=self.hop_size,
+                batch_size=self.batch_size,
+                verbose=False,
+            )
+            for (i, _), emb in zip(clips, embeddings):
+                results[i] = emb.mean(axis=0).astype(np.float32)
+
+        return results
+
+
+BACKENDS = {
+    MfccBackend.name: MfccBackend,
+    OpenL3Backend.name: OpenL3Backend,
+}
+
+_instances = {}
+
+
+# Returns the shared instance of a backend so models are only loaded once per process
+def get_backend(name: str = None) -> FeatureBackend:
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown feature backend '{name}', expected one of {list(BACKENDS)}")
+    if name not in _instances:
+        _instances[name] = BACKENDS[name]()
+    return _instances[name]
+
+
+# Directory holding the cached per-track .npy features for a backend. The MFCC
+# backend keeps the original flat layout so existing caches stay valid.
+def feature_dir(backend: FeatureBackend, processed_dir: str = PROCESSED_DIR) -> str:
+    if backend.name == MfccBackend.name:
+        return processed_dir
+    return os.path.join(processed_dir, "features", backend.tag)
+
+
+# Index, scaler, projection, metadata and mapping files for a backend. MFCC keeps the
+# original file names, other backends get their name as a suffix.
+def artifact_paths(backend: FeatureBackend, processed_dir: str = PROCESSED_DIR, models_dir: str = MODELS_DIR) -> dict:
+    suffix = "" if backend.name == MfccBackend.name else f"_{backend.name}"
+    return {
+        "index": os.path.join(models_dir, f"faiss_index{suffix}.bin"),
+        "scaler": os.path.join(models_dir, f"feature_scaler{suffix}.pkl"),
+        "projection": os.path.join(models_dir, f"feature_projection{suffix}.bin"),
+        "meta": os.path.join(processed_dir, f"metadata{suffix}.csv"),
+        "mapping": os.path.join(processed_dir, f"index_mapping{suffix}.csv"),
+    }
+
+
+if __name__ == "__main__":
+    # tests backend selection and artifact layout
+    mfcc = get_backend("mfcc")
+    assert get_backend("mfcc") is mfcc
+    assert feature_dir(mfcc) == PROCESSED_DIR
+    assert artifact_paths(mfcc)["index"] == os.path.join("models", "faiss_index.bin")
+
+    l3 = get_backend("openl3")
+    assert l3.dim == 512
+    assert feature_dir(l3).endswith(l3.tag)
+    assert artifact_paths(l3)["index"] != artifact_paths(mfcc)["index"]
+
+    try:
+        get_backend("nope")
+        raise AssertionError("unknown backend should raise")
+    except ValueError:
+        pass
+
+    # OpenL3 batching, with a stub in place of the openl3 package: frames from
+    # several clips must go into one inference call and come back in order
+    import sys
+    import tempfile
+    import types
+    import soundfile as sf
+
+    calls = []
+
+    def fake_embedding(audio, sr, model=None, hop_size=0.1, batch_size=32, verbose=True):
+        calls.append(len(audio))
+        # one embedding row per frame, filled with the clip length so order can be checked
+        return [np.full((3, l3.dim), len(y), dtype=np.float32) for y in audio], [None] * len(audio)
+
+    sys.modules["openl3"] = types.SimpleNamespace(
+        models=types.SimpleNamespace(load_audio_embedding_model=lambda **kwargs: "model"),
+        get_audio_embedding=fake_embedding,
+    )
+    l3 = OpenL3Backend(clips_per_call=4)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for seconds in (1.0, 2.0, 3.0):
+            path = os.path.join(tmp, f"clip{seconds:g}.wav")
+            sf.write(path, np.zeros(int(seconds * l3.sample_rate), dtype=np.float32), l3.sample_rate)
+            paths.append(path)
+        paths.insert(1, os.path.join(tmp, "missing.wav"))
+
+        vectors = l3.extract_many(paths)
+    assert calls == [3], calls
+    assert vectors[1].size == 0
+    assert [int(v[0]) for i, v in enumerate(vectors) if i != 1] == [48000, 96000, 144000]
+    assert all(v.shape == (l3.dim,) for i, v in enumerate(vectors) if i != 1)
+    del sys.modules["openl3"]
+
+    print("All tests passed.\n")
@@ -0,0 +1,276 @@
+"""
+Micro-benchmarks for features/extract_features.py.
+
+Synthesizes deterministic audio offline (sine tones, white noise and click tracks
+at several lengths and sample rates), times every librosa stage of the feature
+vector plus the full vector and the file decode, records peak memory per stage,
+and writes a JSON report that can be diffed against a report from another commit.
+It can also check alternative extractor implementations for numerical
+equivalence with the reference one.
+
+    python -m features.benchmark_features --out bench_features.json
+    python -m features.benchmark_features --baseline old.json --compare mymod:my_extractor
+"""
+
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+from features.extract_features import extract_features, extract_features_batch, extract_features_from_signal
+
+SIGNALS = ("tone", "noise", "clicks")
+DURATIONS = (5.0, 15.0, 30.0)
+SAMPLE_RATES = (22050, 44100)
+REPEATS = 3
+SEED = 0
+
+
+# Deterministic test signal: a chord of three tones, seeded white noise, or a
+# 120 bpm click track over a quiet tone so beat tracking has something to find
+def synth_signal(kind: str, duration: float, sr: int, seed: int = SEED) -> np.ndarray:
+    t = np.arange(int(duration * sr)) / sr
+    rng = np.random.default_rng(seed)
+
+    if kind == "tone":
+        y = sum(0.2 * np.sin(2 * np.pi * f * t) for f in (220.0, 277.18, 329.63))
+    elif kind == "noise":
+        y = 0.3 * rng.standard_normal(len(t))
+    elif kind == "clicks":
+        y = 0.05 * np.sin(2 * np.pi * 440.0 * t)
+        click = np.hanning(int(0.01 * sr))
+        for start in librosa.time_to_samples(np.arange(0, duration, 0.5), sr=sr):
+            end = min(start + len(click), len(y))
+            y[start:end] += 0.8 * click[:end - start]
+    else:
+        raise ValueError(f"Unknown signal kind '{kind}', expected one of {SIGNALS}")
+
+    return y.astype(np.float32)
+
+
+# Each stage makes the same librosa call extract_features_from_signal does
+STAGES = {
+    "beat_track": lambda y, sr: librosa.beat.beat_track(y=y, sr=sr),
+    "mfcc": lambda y, sr: librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13),
+    "chroma_stft": lambda y, sr: librosa.feature.chroma_stft(y=y, sr=sr),
+    "spectral_contrast": lambda y, sr: librosa.feature.spectral_contrast(y=y, sr=sr),
+    "tonnetz": lambda y, sr: librosa.feature.tonnetz(y=y, sr=sr),
+    "full_vector": extract_features_from_signal,
+}
+
+# Implementations checked against the reference, each maps (y, sr) -> 64-dim vector
+IMPLEMENTATIONS = {
+    "reference": extract_features_from_signal,
+    "batch": lambda y, sr: extract_features_batch([y], sr)[0],
+}
+
+
+def _time_call(fn, repeats: int):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+# Peak Python-heap memory of one call (numpy buffers are tracked by tracemalloc).
+# Measured in a separate run so tracing doesn't skew the timings.
+def _peak_memory_mb(fn) -> float:
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 2**20
+
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def benchmark_stages(signals=SIGNALS, durations=DURATIONS, sample_rates=SAMPLE_RATES,
+                     repeats: int = REPEATS, measure_memory: bool = True) -> list:
+    rows = []
+    for sr in sample_rates:
+        for duration in durations:
+            for kind in signals:
+                y = synth_signal(kind, duration, sr)
+
+                # the decode step, through a temporary wav like a real upload
+                with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
+                    wav_path = tmp.name
+                try:
+                    sf.write(wav_path, y, sr)
+                    stages = dict(STAGES)
+                    stages["load"] = lambda y, sr: librosa.load(wav_path, sr=None, mono=True)
+                    stages["extract_features"] = lambda y, sr: extract_features(wav_path)
+
+                    for name, stage in stages.items():
+                        fn = lambda: stage(y, sr)
+                        fn()  # warm-up (numba compilation, filter caches)
+                        times = _time_call(fn, repeats)
+                        rows.append({
+                            "signal": kind,
+                            "duration_s": duration,
+                            "sr": sr,
+                            "stage": name,
+                            "mean_s": float(np.mean(times)),
+                            "min_s": float(np.min(times)),
+                            "std_s": float(np.std(times)),
+                            "peak_mb": _peak_memory_mb(fn) if measure_memory else None,
+                        })
+                finally:
+                    os.remove(wav_path)
+    return rows
+
+
+# Runs every implementation on every test signal and compares it with "reference"
+def compare_implementations(implementations=None, signals=SIGNALS, durations=DURATIONS,
+                            sample_rates=SAMPLE_RATES, rtol: float = 1e-4, atol: float = 1e-4) -> list:
+    implementations = implementations or IMPLEMENTATIONS
+    reference = implementations.get("reference", extract_features_from_signal)
+
+    rows = []
+    for sr in sample_rates:
+        for duration in durations:
+            for kind in signals:
+                y = synth_signal(kind, duration, sr)
+                expected = reference(y, sr)
+                for name, impl in implementations.items():
+                    if name == "reference":
+                        continue
+                    start = time.perf_counter()
+                    got = np.asarray(impl(y, sr), dtype=np.float32)
+                    elapsed = time.perf_counter() - start
+
+                    same_shape = got.shape == expected.shape
+                    diff = np.abs(got - expected) if same_shape else np.array([np.inf])
+                    rows.append({
+                        "implementation": name,
+                        "signal": kind,
+                        "duration_s": duration,
+                        "sr": sr,
+                        "equivalent": bool(same_shape and np.allclose(got, expected, rtol=rtol, atol=atol)),
+                        "max_abs_diff": float(diff.max()),
+                        "worst_dim": int(diff.argmax()) if same_shape else None,
+                        "seconds": elapsed,
+                    })
+    return rows
+
+
+# Mean time per stage relative to a previous report (>1 means slower now), over
+# the signal/duration/rate combinations both reports measured
+def compare_with_baseline(report: dict, baseline: dict) -> dict:
+    def keyed(rows):
+        return {(r["signal"], r["duration_s"], r["sr"], r["stage"]): r["mean_s"] for r in rows}
+
+    now, before = keyed(report["stages"]), keyed(baseline["stages"])
+    totals = {}
+    for key in now.keys() & before.keys():
+        stage = key[-1]
+        t_now, t_before = totals.get(stage, (0.0, 0.0))
+        totals[stage] = (t_now + now[key], t_before + before[key])
+    return {stage: t_now / t_before for stage, (t_now, t_before) in totals.items() if t_before > 0}
+
+
+def run(signals=SIGNALS, durations=DURATIONS, sample_rates=SAMPLE_RATES, repeats: int = REPEATS,
+        implementations=None, measure_memory: bool = True) -> dict:
+    return {
+        "commit": _git_commit(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "librosa": librosa.__version__,
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            "signals": list(signals),
+            "durations_s": list(durations),
+            "sample_rates": list(sample_rates),
+            "repeats": repeats,
+            "seed": SEED,
+        },
+        "stages": benchmark_stages(signals, durations, sample_rates, repeats, measure_memory),
+        "equivalence": compare_implementations(implementations, signals, durations, sample_rates),
+    }
+
+
+def _load_implementation(spec: str):
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def _print_summary(report: dict):
+    print(f"\nStage cost summed over all test signals (commit {report['commit']}):")
+    totals = {}
+    for r in report["stages"]:
+        totals.setdefault(r["stage"], [0.0, 0.0])
+        totals[r["stage"]][0] += r["mean_s"]
+        totals[r["stage"]][1] = max(totals[r["stage"]][1], r["peak_mb"] or 0.0)
+    for stage, (secs, peak) in sorted(totals.items(), key=lambda kv: -kv[1][0]):
+        memory = f"peak {peak:8.1f} MB" if peak else ""
+        print(f"  {stage:<18} {secs:8.3f} s   {memory}")
+
+    for r in report["equivalence"]:
+        if not r["equivalent"]:
+            print(f"  [DIFF] {r['implementation']} on {r['signal']} {r['duration_s']}s @ {r['sr']}: "
+                  f"max abs diff {r['max_abs_diff']:.3g} at dim {r['worst_dim']}")
+
+
+if __name__ == "__main__":
+    # tests the signal generator is deterministic and the right length
+    a = synth_signal("noise", 1.0, 8000)
+    b = synth_signal("noise", 1.0, 8000)
+    assert np.array_equal(a, b) and len(a) == 8000
+    assert synth_signal("clicks", 2.0, 8000).max() > 0.5
+
+    print("All tests passed.\n")
+
+    parser = argparse.ArgumentParser(description="Benchmark the feature extraction stages")
+    parser.add_argument("--out", default="bench_features.json")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--durations", type=float, nargs="+", default=list(DURATIONS))
+    parser.add_argument("--rates", type=int, nargs="+", default=list(SAMPLE_RATES))
+    parser.add_argument("--signals", nargs="+", choices=SIGNALS, default=list(SIGNALS))
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("--compare", nargs="*", default=[],
+                        help="extra implementations to check, as module:function taking (y, sr)")
+    parser.add_argument("--baseline", help="previous report to compare stage timings against")
+    args = parser.parse_args()
+
+    impls = dict(IMPLEMENTATIONS)
+    for spec in args.compare:
+        impls[spec] = _load_implementation(spec)
+
+    report = run(args.signals, args.durations, args.rates, args.repeats, impls, not args.no_memory)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["vs_baseline"] = compare_with_baseline(report, json.load(f))
+        for stage, ratio in report["vs_baseline"].items():
+            print(f"  {stage:<18} {ratio:6.2f}x baseline time")
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    _print_summary(report)
+    print(f"\nSaved report: {args.out}")
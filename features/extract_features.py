@@ -1,6 +1,15 @@
+import os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
 import librosa
 import numpy as np
 
+# Decoded MP3s of the same clip length differ by a few ms, so files within this
+# many seconds of each other are trimmed to the shortest one and batched together
+TRIM_TOLERANCE = 0.05
+
 def flatten(x) -> np.ndarray:
     if x is None or not hasattr(x, "size") or x.size == 0:
         return np.zeros(1)
@@ -13,45 +22,259 @@ def extract_features(file_path: str) -> np.ndarray:
             print(f"[WARN] {file_path} too short or unreadable, skipping.")
             return np.array([])
 
-        # Tempo
-        tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-        tempo = np.array([tempo]) 
+        return extract_features_from_signal(y, sr)
 
-        # MFCCs
-        mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-        mfcc_mean = np.mean(mfcc, axis=1)
-        mfcc_std = np.std(mfcc, axis=1)
+    except Exception as e:
+        print(f"Failed to process {file_path}: {e}")
+        return np.array([])
 
-        # Chroma
-        chroma = librosa.feature.chroma_stft(y=y, sr=sr)
-        chroma_mean = np.mean(chroma, axis=1)
-        chroma_std = np.std(chroma, axis=1)
 
-        # Spectral contrast
-        contrast = librosa.feature.spectral_contrast(y=y, sr=sr)
-        contrast_mean = np.mean(contrast, axis=1)
+# The 64-dim vector for a signal that's already loaded
+def extract_features_from_signal(y: np.ndarray, sr: int) -> np.ndarray:
+    # Tempo
+    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
+    tempo = np.array([tempo]) 
 
-        # Tonnetz
-        tonnetz = librosa.feature.tonnetz(y=y, sr=sr)
-        tonnetz_mean = np.mean(tonnetz, axis=1)
+    # MFCCs
+    mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
+    mfcc_mean = np.mean(mfcc, axis=1)
+    mfcc_std = np.std(mfcc, axis=1)
 
-        # Combine features
-        parts = [
-            flatten(tempo),
-            flatten(mfcc_mean), flatten(mfcc_std),
-            flatten(chroma_mean), flatten(chroma_std),
-            flatten(contrast_mean), flatten(tonnetz_mean)
-        ]
-        feature_vector = np.concatenate(parts).astype(np.float32)
+    # Chroma
+    chroma = librosa.feature.chroma_stft(y=y, sr=sr)
+    chroma_mean = np.mean(chroma, axis=1)
+    chroma_std = np.std(chroma, axis=1)
 
-        return feature_vector
+    # Spectral contrast
+    contrast = librosa.feature.spectral_contrast(y=y, sr=sr)
+    contrast_mean = np.mean(contrast, axis=1)
 
-    except Exception as e:
-        print(f"Failed to process {file_path}: {e}")
-        return np.array([])
+    # Tonnetz
+    tonnetz = librosa.feature.tonnetz(y=y, sr=sr)
+    tonnetz_mean = np.mean(tonnetz, axis=1)
+
+    # Combine features
+    parts = [
+        flatten(tempo),
+        flatten(mfcc_mean), flatten(mfcc_std),
+        flatten(chroma_mean), flatten(chroma_std),
+        flatten(contrast_mean), flatten(tonnetz_mean)
+    ]
+    feature_vector = np.concatenate(parts).astype(np.float32)
+
+    return feature_vector
+
+
+# Stacks equal-length mono signals into an (n, samples) matrix. Signals of
+# different lengths are refused rather than padded, since padded frames would
+# be averaged into every statistic and change the vector.
+def stack_signals(signals) -> np.ndarray:
+    if isinstance(signals, np.ndarray) and signals.ndim == 2:
+        return signals.astype(np.float32, copy=False)
+
+    lengths = sorted({len(y) for y in signals})
+    if len(lengths) > 1:
+        raise ValueError(f"Batched extraction needs equal-length signals, got lengths {lengths[0]}..{lengths[-1]}")
+    if not lengths:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack([np.asarray(y, dtype=np.float32) for y in signals])
+
+
+# Groups row numbers by a per-row key (e.g. estimated tuning) so stages that
+# take a single scalar parameter can still run batched over each group.
+def _group_rows(keys):
+    groups = {}
+    for i, key in enumerate(keys):
+        groups.setdefault(float(key), []).append(i)
+    return [(key, np.array(rows)) for key, rows in groups.items()]
+
+
+# estimate_tuning works in steps of 0.01, so there are only ~100 distinct banks
+@lru_cache(maxsize=256)
+def _chroma_filters(sr: int, n_fft: int, tuning: float) -> np.ndarray:
+    return librosa.filters.chroma(sr=sr, n_fft=n_fft, tuning=tuning)
+
+
+# chroma_stft for a batch where every row has its own tuning: one filter bank
+# per row, applied in a single einsum
+def _chroma_stft_rows(power: np.ndarray, sr: int, tunings) -> np.ndarray:
+    n_fft = 2 * (power.shape[-2] - 1)
+    banks = np.stack([_chroma_filters(sr, n_fft, float(t)) for t in tunings])
+    raw = np.einsum("ncf,nft->nct", banks, power, optimize=True)
+    return librosa.util.normalize(raw, norm=np.inf, axis=-2)
+
+
+# Splits items into runs whose lengths are within `tolerance` samples of the
+# shortest one. Items are (length, payload) pairs.
+def _length_groups(items, tolerance: int) -> list:
+    groups = []
+    for length, payload in sorted(items, key=lambda item: item[0]):
+        if groups and length - groups[-1][0] <= tolerance:
+            groups[-1][1].append(payload)
+        else:
+            groups.append((length, [payload]))
+    return groups
+
+
+# Batched version of extract_features for signals that are already loaded and
+# share a sample rate and length. The STFT is computed once and shared by the
+# tuning, MFCC, chroma and contrast stages, and the onset, mel/MFCC and chroma
+# stages run over the whole batch. Tempo, tuning and contrast stay per row: their
+# batched librosa forms either pool statistics across clips or measured slower.
+# Returns an (n, 64) matrix with the same layout as extract_features.
+def extract_features_batch(signals, sr: int) -> np.ndarray:
+    Y = stack_signals(signals)
+    if Y.shape[0] == 0:
+        return np.zeros((0, 64), dtype=np.float32)
+
+    n = Y.shape[0]
+
+    # Shared magnitude spectrogram, shape (n, 1 + n_fft/2, frames)
+    S = np.abs(librosa.stft(Y))
+    power = S ** 2
+
+    # Tempo: onset envelopes are batched, the beat tracker itself is per row
+    onset_env = librosa.onset.onset_strength(y=Y, sr=sr, aggregate=np.median)
+    tempo = np.empty((n, 1), dtype=np.float32)
+    for i in range(n):
+        t, _ = librosa.beat.beat_track(onset_envelope=onset_env[i], sr=sr)
+        tempo[i] = flatten(np.asarray(t))[0]
+
+    # MFCCs, with the dB floor taken per clip rather than across the batch
+    mel = librosa.feature.melspectrogram(S=power, sr=sr)
+    mel_db = librosa.power_to_db(mel, top_db=None)
+    mel_db = np.maximum(mel_db, mel_db.max(axis=(-2, -1), keepdims=True) - 80.0)
+    mfcc = librosa.feature.mfcc(S=mel_db, n_mfcc=13)
+    mfcc_mean = np.mean(mfcc, axis=-1)
+    mfcc_std = np.std(mfcc, axis=-1)
+
+    # Chroma, each clip with its own estimated tuning
+    tunings = [librosa.estimate_tuning(S=power[i], sr=sr, bins_per_octave=12) for i in range(n)]
+    chroma = _chroma_stft_rows(power, sr, tunings)
+    chroma_mean = np.mean(chroma, axis=-1)
+    chroma_std = np.std(chroma, axis=-1)
+
+    # Spectral contrast converts to dB against each clip's own peak, so it
+    # runs per row on the shared spectrogram
+    contrast_mean = np.stack([
+        np.mean(librosa.feature.spectral_contrast(S=S[i], sr=sr), axis=-1)
+        for i in range(n)
+    ])
+
+    # Tonnetz (uses its own CQT chroma, same as the per-track path). The CQT
+    # filters depend on the tuning, so only clips with equal tuning share a call.
+    tonnetz_mean = np.empty((n, 6), dtype=np.float32)
+    tunings = [librosa.estimate_tuning(S=S[i], sr=sr, bins_per_octave=36) for i in range(n)]
+    for tuning, rows in _group_rows(tunings):
+        chroma_cq = librosa.feature.chroma_cqt(y=Y[rows], sr=sr, tuning=tuning)
+        tonnetz = librosa.feature.tonnetz(y=Y[rows], sr=sr, chroma=chroma_cq)
+        tonnetz_mean[rows] = np.mean(tonnetz, axis=-1)
+
+    features = np.concatenate([
+        tempo,
+        mfcc_mean, mfcc_std,
+        chroma_mean, chroma_std,
+        contrast_mean, tonnetz_mean
+    ], axis=1).astype(np.float32)
+
+    return features
+
+
+# Worker for extract_features_many: loads one chunk of files, groups them by
+# sample rate and near-equal length (trimmed to the shortest in the group) and
+# runs extract_features_batch per group. Files without a partner go through the
+# per-track path. Failed or too short files come back as empty arrays, like
+# extract_features.
+def _extract_chunk(file_paths) -> list:
+    results = [np.array([])] * len(file_paths)
+    by_sr = {}
+
+    for i, path in enumerate(file_paths):
+        try:
+            y, sr = librosa.load(path, sr=None, mono=True)
+        except Exception as e:
+            print(f"Failed to process {path}: {e}")
+            continue
+        if y is None or len(y) < sr / 2:
+            print(f"[WARN] {path} too short or unreadable, skipping.")
+            continue
+        by_sr.setdefault(sr, []).append((len(y), (i, y)))
+
+    groups = [(sr, length, items)
+              for sr, entries in by_sr.items()
+              for length, items in _length_groups(entries, int(TRIM_TOLERANCE * sr))]
+
+    for sr, length, items in groups:
+        if len(items) == 1:
+            i, y = items[0]
+            try:
+                results[i] = extract_features_from_signal(y, sr)
+            except Exception as e:
+                print(f"Failed to process {file_paths[i]}: {e}")
+            continue
+        try:
+            batch = extract_features_batch([y[:length] for _, y in items], sr)
+        except Exception as e:
+            print(f"Batch failed at sr={sr} ({e}), falling back to per-track extraction")
+            for i, _ in items:
+                results[i] = extract_features(file_paths[i])
+            continue
+        for (i, _), vec in zip(items, batch):
+            results[i] = vec
+
+    return results
+
+
+# Extracts features for many files at once. Files are split into chunks of
+# `batch_size`, and each chunk is loaded and extracted in a worker process.
+# Returns a list aligned with file_paths, with empty arrays for failures.
+def extract_features_many(file_paths, batch_size: int = 32, workers: int = None) -> list:
+    file_paths = list(file_paths)
+    chunks = [file_paths[i:i + batch_size] for i in range(0, len(file_paths), batch_size)]
+    if not chunks:
+        return []
+
+    workers = workers or os.cpu_count() or 1
+    # daemon processes (such as the ingest workers) can't start a pool of their own
+    if workers == 1 or len(chunks) == 1 or mp.current_process().daemon:
+        chunk_results = [_extract_chunk(c) for c in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            chunk_results = list(pool.map(_extract_chunk, chunks))
+
+    return [vec for chunk in chunk_results for vec in chunk]
 
 
 if __name__ == "__main__":
+    # Check the batched path against the per-track layout on synthetic audio
+    sr = 22050
+    t = np.arange(int(sr * 5)) / sr
+    clips = [np.sin(2 * np.pi * f * t).astype(np.float32) for f in (220.0, 440.0, 880.0)]
+    batch = extract_features_batch(clips, sr)
+    assert batch.shape == (3, 64), f"Unexpected batch shape {batch.shape}"
+
+    try:
+        stack_signals([clips[0][:sr], clips[1]])
+        raise AssertionError("mixed-length signals should not be stacked")
+    except ValueError:
+        pass
+
+    # Mixed-length files: 4.0, 4.0 and 4.02 s are batched (the last one trimmed
+    # to 4.0 s), 4.1 and 3.0 s go through the per-track path
+    import tempfile
+    import soundfile as sf
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for j, seconds in enumerate((4.0, 4.0, 4.1, 3.0, 4.02)):
+            path = os.path.join(tmp, f"clip{j}.wav")
+            sf.write(path, clips[j % 3][:int(sr * seconds)], sr, subtype="FLOAT")
+            paths.append(path)
+        for path, vec in zip(paths, _extract_chunk(paths)):
+            y, _ = librosa.load(path, sr=None, mono=True)
+            expected = extract_features_from_signal(y[:int(sr * 4.0)] if len(y) == int(sr * 4.02) else y, sr)
+            assert np.allclose(vec, expected, atol=1e-4), f"Batched features differ for {path}"
+    print("All tests passed.\n")
+
     # Test the feature extraction
     sample_file = "C:\\Users\\sgilt\\OneDrive\\Desktop\\Vybe\\data\\raw\\fma_small\\000\\000193.mp3"
     features = extract_features(sample_file)
@@ -0,0 +1,172 @@
+"""
+Optional learned projection between the feature scaler and the index.
+
+PCA (optionally whitened) or OPQ is fitted on the standardized vectors when the
+index is built, saved next to the scaler, and applied to every query in the same
+order: standardize -> project -> L2-normalize. It keeps index size and query cost
+down as the feature vector grows (e.g. 512-dim OpenL3 embeddings).
+"""
+
+import os
+import zlib
+
+import faiss
+import numpy as np
+import pandas as pd
+
+PROJECTION_KINDS = ("pca", "pca-whiten", "opq")
+OPQ_MIN_ROWS = 256  # OPQ trains 8-bit PQ codebooks, so k-means needs a row per centroid
+
+
+# Fits a projection from X's dimension down to dim. PCA can't output more
+# dimensions than there are training rows, so dim is capped by both.
+def fit_projection(X: np.ndarray, kind: str = "pca", dim: int = 32, opq_subspaces: int = None):
+    X = np.ascontiguousarray(X, dtype="float32")
+    n, d_in = X.shape
+    max_dim = min(n, d_in)
+    if not 0 < dim <= max_dim:
+        raise ValueError(f"Projection dim must be between 1 and {max_dim} "
+                         f"({n} vectors of {d_in} dims), got {dim}")
+    if kind == "opq" and n < OPQ_MIN_ROWS:
+        raise ValueError(f"OPQ needs at least {OPQ_MIN_ROWS} vectors to train, got {n}")
+
+    if kind == "pca":
+        vt = faiss.PCAMatrix(d_in, dim)
+    elif kind == "pca-whiten":
+        vt = faiss.PCAMatrix(d_in, dim, -0.5)
+    elif kind == "opq":
+        # OPQ learns a rotation that balances variance across subspaces
+        m = opq_subspaces or next(m for m in (16, 8, 4, 2, 1) if dim % m == 0)
+        vt = faiss.OPQMatrix(d_in, m, dim)
+        vt.verbose = False
+    else:
+        raise ValueError(f"Unknown projection '{kind}', expected one of {PROJECTION_KINDS}")
+
+    vt.train(X)
+    return vt
+
+
+def save_projection(vt, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    faiss.write_VectorTransform(vt, path)
+
+
+# Returns the saved projection, or None if the index was built without one
+def load_projection(path: str):
+    if not os.path.exists(path):
+        return None
+    return faiss.read_VectorTransform(path)
+
+
+# Identifies the projection saved at path (kind, dims and a checksum of the file),
+# so indexes built with it can be checked against it later. None if there is none.
+def projection_signature(path: str):
+    vt = load_projection(path)
+    if vt is None:
+        return None
+    if isinstance(vt, faiss.PCAMatrix):
+        kind = "pca-whiten" if vt.eigen_power else "pca"
+    else:  # OPQ is read back as a plain LinearTransform
+        kind = "opq"
+    with open(path, "rb") as f:
+        checksum = zlib.crc32(f.read())
+    return {"kind": kind, "d_in": int(vt.d_in), "dim": int(vt.d_out), "crc32": checksum}
+
+
+# Standardize -> project -> L2-normalize, for index vectors and queries alike
+def transform_vectors(X: np.ndarray, scaler, projection=None) -> np.ndarray:
+    X = np.asarray(X, dtype="float32")
+    if X.ndim == 1:
+        X = X.reshape(1, -1)
+    Xz = scaler.transform(X).astype("float32")
+    if projection is not None:
+        Xz = projection.apply(np.ascontiguousarray(Xz))
+    Xz = np.ascontiguousarray(Xz, dtype="float32")
+    faiss.normalize_L2(Xz)
+    return Xz
+
+
+# For each candidate dimension: the share of variance PCA keeps, and how many of
+# the true top-k neighbours (found with the full standardized vectors) are still
+# found after projecting. Xz is the standardized, not yet normalized, matrix.
+def projection_report(Xz: np.ndarray, dims, kind: str = "pca", k: int = 10, n_queries: int = 200, seed: int = 0) -> pd.DataFrame:
+    Xz = np.ascontiguousarray(Xz, dtype="float32")
+    k = min(k, len(Xz))
+    rng = np.random.default_rng(seed)
+    q_rows = rng.choice(len(Xz), size=min(n_queries, len(Xz)), replace=False)
+
+    full = Xz.copy()
+    faiss.normalize_L2(full)
+    index = faiss.IndexFlatIP(full.shape[1])
+    index.add(full)
+    _, I_ref = index.search(full[q_rows], k)
+
+    # the eigen-decomposition only has min(n, d) components
+    pca_full = faiss.PCAMatrix(Xz.shape[1], min(Xz.shape))
+    pca_full.train(Xz)
+    eigen = np.clip(faiss.vector_to_array(pca_full.eigenvalues), 0, None)
+    explained = np.cumsum(eigen) / eigen.sum()
+
+    rows = []
+    for dim in dims:
+        try:
+            vt = fit_projection(Xz, kind, dim)
+        except ValueError as e:
+            print(f"[WARN] Skipping dim {dim}: {e}")
+            continue
+        Xp = np.ascontiguousarray(vt.apply(Xz), dtype="float32")
+        faiss.normalize_L2(Xp)
+        index = faiss.IndexFlatIP(dim)
+        index.add(Xp)
+        _, I = index.search(Xp[q_rows], k)
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(I, I_ref)])
+        rows.append({
+            "kind": kind,
+            "dim": dim,
+            "explained_variance": float(explained[dim - 1]),
+            f"recall@{k}": float(recall),
+            "bytes_per_vector": dim * 4,
+        })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    # tests on low-rank data, where a small PCA should keep the neighbours
+    rng = np.random.default_rng(0)
+    X = (rng.standard_normal((1000, 8)) @ rng.standard_normal((8, 64))).astype("float32")
+    X += 0.01 * rng.standard_normal(X.shape).astype("float32")
+
+    class Identity:
+        def transform(self, X):
+            return X
+
+    for kind in PROJECTION_KINDS:
+        vt = fit_projection(X, kind, 16)
+        out = transform_vectors(X[:5], Identity(), vt)
+        assert out.shape == (5, 16)
+        assert np.allclose(np.linalg.norm(out, axis=1), 1.0, atol=1e-4)
+
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "projection.bin")
+        assert projection_signature(path) is None
+        save_projection(fit_projection(X, "pca-whiten", 16), path)
+        sig = projection_signature(path)
+        assert sig["kind"] == "pca-whiten" and sig["dim"] == 16 and sig["d_in"] == 64
+
+    report = projection_report(X, [4, 8, 16])
+    assert report["explained_variance"].iloc[-1] > 0.99
+    assert report["recall@10"].iloc[-1] > 0.9
+
+    # fewer rows than dimensions, as in a small library
+    small = projection_report(X[:12], [4, 8, 64])
+    assert list(small["dim"]) == [4, 8]
+    for kind, dim in (("pca", 13), ("opq", 8)):
+        try:
+            fit_projection(X[:12], kind, dim)
+            raise AssertionError(f"{kind} to {dim} dims from 12 rows should be rejected")
+        except ValueError:
+            pass
+
+    print("All tests passed.\n")
+    print(report.to_string(index=False))
@@ -0,0 +1,152 @@
+"""
+Compact index variants for the cosine similarity index built by utils/new_index.py.
+
+The flat index keeps every vector as float32. The scalar quantized variants keep
+2 bytes (fp16) or 1 byte (int8) per dimension instead, and still support
+index.reconstruct so tools like search.get_cherry_vector_by_filename keep working.
+"""
+
+import faiss
+import numpy as np
+import pandas as pd
+
+# Ordered from most to least precise, which is also the order we try them in
+INDEX_KINDS = ("flat", "fp16", "int8")
+
+BYTES_PER_DIM = {"flat": 4, "fp16": 2, "int8": 1}
+
+SQ_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+# Builds an inner product index of the given kind over X (already scaled + normalized)
+def build_index(X: np.ndarray, kind: str = "flat"):
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown index kind '{kind}', expected one of {INDEX_KINDS}")
+
+    X = np.ascontiguousarray(X, dtype="float32")
+    d = X.shape[1]
+
+    if kind == "flat":
+        index = faiss.IndexFlatIP(d)
+    else:
+        index = faiss.IndexScalarQuantizer(d, SQ_TYPES[kind], faiss.METRIC_INNER_PRODUCT)
+        # int8 learns per-dimension ranges, fp16 is a no-op
+        index.train(X)
+
+    index.add(X)
+    return index
+
+
+# Rough in-memory size of an index with n vectors of dimension d
+def estimate_index_bytes(kind: str, n: int, d: int) -> int:
+    size = n * d * BYTES_PER_DIM[kind]
+    if kind == "int8":
+        size += 2 * d * 4  # trained min/range per dimension
+    return size
+
+
+# Actual serialized size of an index, which is what gets loaded into memory
+def index_bytes(index) -> int:
+    return int(faiss.serialize_index(index).size)
+
+
+# In-memory size of the lookup tables a serving process loads next to the index
+# (index mapping, library metadata)
+def metadata_bytes(*frames: pd.DataFrame) -> int:
+    return int(sum(df.memory_usage(deep=True).sum() for df in frames))
+
+
+# Picks the most precise index kind for which `replicas` serving copies, each
+# holding the index plus extra_bytes of metadata, fit in budget_bytes
+def choose_index_kind(n: int, d: int, budget_bytes: int, replicas: int = 1, extra_bytes: int = 0) -> str:
+    for kind in INDEX_KINDS:
+        if replicas * (estimate_index_bytes(kind, n, d) + extra_bytes) <= budget_bytes:
+            return kind
+    smallest = replicas * (estimate_index_bytes(INDEX_KINDS[-1], n, d) + extra_bytes)
+    raise ValueError(
+        f"No index kind fits in {budget_bytes / 2**20:.1f} MB "
+        f"(smallest is {kind}: {replicas} x (index + {extra_bytes / 2**20:.1f} MB metadata) "
+        f"= {smallest / 2**20:.1f} MB)"
+    )
+
+
+# Searches k + 1 and drops each query's own row, since the queries are rows of
+# the index and would otherwise always find themselves first
+def _search_without_self(index, Q: np.ndarray, q_rows: np.ndarray, k: int):
+    D, I = index.search(Q, k + 1)
+    others = I != q_rows[:, None]
+    order = np.argsort(~others, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+
+
+# Compares each index kind against the float32 baseline: memory use, how far
+# reconstructed vectors drift, and how much the top-k results and their
+# similarity scores change for a sample of queries drawn from the data
+# (each query's own vector is left out of its results).
+def quantization_report(X: np.ndarray, kinds=INDEX_KINDS, k: int = 10, n_queries: int = 200, seed: int = 0) -> pd.DataFrame:
+    X = np.ascontiguousarray(X, dtype="float32")
+    k = min(k, len(X) - 1)
+    rng = np.random.default_rng(seed)
+    q_rows = rng.choice(len(X), size=min(n_queries, len(X)), replace=False)
+    Q = X[q_rows]
+
+    baseline = build_index(X, "flat")
+    D_ref, I_ref = _search_without_self(baseline, Q, q_rows, k)
+    baseline_bytes = index_bytes(baseline)
+
+    rows = []
+    for kind in kinds:
+        index = baseline if kind == "flat" else build_index(X, kind)
+        D, I = _search_without_self(index, Q, q_rows, k)
+
+        recon = index.reconstruct_n(0, index.ntotal)
+        recon_err = np.abs(recon - X).max(axis=1)
+
+        # exact similarity of the returned ids vs the score the index reports
+        exact = np.einsum("qd,qkd->qk", Q, X[I])
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(I, I_ref)])
+
+        size = index_bytes(index)
+        rows.append({
+            "kind": kind,
+            "mb": size / 2**20,
+            "ratio_vs_flat": size / baseline_bytes,
+            f"recall@{k}": recall,
+            "score_err_mean": float(np.mean(np.abs(D - exact))),
+            "score_err_max": float(np.max(np.abs(D - exact))),
+            "top1_sim_drop": float(np.mean(D_ref[:, 0] - exact[:, 0])),
+            "recon_err_max": float(recon_err.max()),
+        })
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    # tests on random unit vectors
+    X = np.random.default_rng(0).standard_normal((500, 64)).astype("float32")
+    faiss.normalize_L2(X)
+
+    for kind in INDEX_KINDS:
+        index = build_index(X, kind)
+        assert index.ntotal == 500
+        vec = index.reconstruct(3)
+        assert np.abs(vec - X[3]).max() < 0.05, f"{kind} reconstruct drifted too far"
+
+    assert choose_index_kind(500, 64, 10**9) == "flat"
+    assert choose_index_kind(500, 64, 500 * 64 * 2) == "fp16"
+    assert choose_index_kind(500, 64, 500 * 64 + 1024) == "int8"
+    assert choose_index_kind(500, 64, 500 * 64 * 4, replicas=2) == "fp16"
+    assert choose_index_kind(500, 64, 500 * 64 * 4, extra_bytes=1) == "fp16"
+
+    report = quantization_report(X)
+    assert report.loc[report["kind"] == "flat", "recall@10"].item() == 1.0
+    q_rows = np.arange(20)
+    _, I = _search_without_self(build_index(X, "int8"), X[q_rows], q_rows, 10)
+    assert I.shape == (20, 10) and not (I == q_rows[:, None]).any(), "queries found themselves"
+
+    print("All tests passed.\n")
+
+    print(report.to_string(index=False))
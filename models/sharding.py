@@ -0,0 +1,219 @@
+"""
+Sharded layout for the similarity index.
+
+Tracks are split into independently built shards, either by a stable hash of
+the filename or by their FMA folder (data/raw/fma_small/<folder>/<track>.mp3),
+and each shard is saved as its own SimilaritySearch index. ShardedSearch queries
+every shard in parallel and merges the per-shard top-k into one ranking, like
+faiss.IndexShards. Shards can run on threads in this process or each in its own
+local worker process, standing in for separate search nodes.
+"""
+
+import json
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing as mp
+
+import numpy as np
+
+from models.similarity_search import SimilaritySearch
+
+SHARDS_DIR = "models/shards"
+SCHEMES = ("hash", "folder")
+MANIFEST_NAME = "manifest.json"
+
+
+# Stable shard number for a track. Python's hash() is salted per process, so crc32 is used.
+def shard_of(filename: str, rel_path: str = None, n_shards: int = 8, scheme: str = "hash") -> int:
+    if scheme == "folder" and isinstance(rel_path, str) and rel_path:
+        key = os.path.basename(os.path.dirname(rel_path.replace("\\", "/")))
+    else:
+        key = filename
+    return zlib.crc32(key.encode("utf-8")) % n_shards
+
+
+def shard_path(shards_dir: str, shard: int) -> str:
+    return os.path.join(shards_dir, f"shard_{shard:03d}.bin")
+
+
+def load_manifest(shards_dir: str) -> dict:
+    path = os.path.join(shards_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No shard manifest found at {path}")
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(shards_dir: str, manifest: dict):
+    os.makedirs(shards_dir, exist_ok=True)
+    tmp_path = os.path.join(shards_dir, MANIFEST_NAME + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(shards_dir, MANIFEST_NAME))
+
+
+# Writes one shard from already scaled + normalized vectors
+def build_shard(shards_dir: str, shard: int, filenames, X: np.ndarray) -> int:
+    model = SimilaritySearch(feature_dim=X.shape[1], metric="ip")
+    if len(filenames):
+        model.add_songs(list(filenames), X)
+    model.save(shard_path(shards_dir, shard))
+    return len(filenames)
+
+
+# Merges per-shard results for a batch of queries into one top-k per query.
+# D and names are lists with one (n_queries, k) array per shard; higher scores win.
+def merge_results(D_list, names_list, k: int):
+    D = np.concatenate(D_list, axis=1)
+    names = np.concatenate(names_list, axis=1)
+    order = np.argsort(-D, axis=1, kind="stable")[:, :k]
+
+    merged = []
+    for q in range(D.shape[0]):
+        hits = [(names[q, j], float(D[q, j])) for j in order[q] if names[q, j] is not None]
+        merged.append(hits)
+    return merged
+
+
+# Searches one loaded shard, returning scores and filenames (None for empty slots)
+def _search_loaded(model: SimilaritySearch, Q: np.ndarray, k: int):
+    k_local = min(k, model.index.ntotal)
+    D = np.full((Q.shape[0], k), -np.inf, dtype="float32")
+    names = np.full((Q.shape[0], k), None, dtype=object)
+    if k_local == 0:
+        return D, names
+
+    D_local, I_local = model.index.search(Q, k_local)
+    D[:, :k_local] = D_local
+    for q in range(Q.shape[0]):
+        for j, pos in enumerate(I_local[q]):
+            if pos >= 0:
+                names[q, j] = model.get_song_id(int(pos))
+    return D, names
+
+
+def _describe(signature) -> str:
+    if signature is None:
+        return "none"
+    return f"{signature['kind']} {signature['d_in']} -> {signature['dim']}"
+
+
+# Worker process state: each worker holds exactly one shard, loaded once
+_worker_model = None
+
+
+def _init_worker(path: str, feature_dim: int, mmap: bool):
+    global _worker_model
+    _worker_model = SimilaritySearch(feature_dim=feature_dim, metric="ip")
+    _worker_model.load(path, mmap=mmap)
+
+
+def _worker_search(Q: np.ndarray, k: int):
+    return _search_loaded(_worker_model, Q, k)
+
+
+class ShardedSearch:
+    # mode="thread" loads all shards here and searches them on a thread pool
+    # (FAISS releases the GIL); mode="process" gives every shard its own
+    # single-worker process that loads it once and answers queries.
+    def __init__(self, shards_dir: str, mode: str = "thread", mmap: bool = True):
+        self.manifest = load_manifest(shards_dir)
+        self.shards_dir = shards_dir
+        self.mode = mode
+        self.feature_dim = self.manifest["dim"]
+        self.shards = sorted(int(s) for s in self.manifest["shards"])
+
+        if mode == "thread":
+            self.models = {}
+            for s in self.shards:
+                model = SimilaritySearch(feature_dim=self.feature_dim, metric="ip")
+                model.load(shard_path(shards_dir, s), mmap=mmap)
+                self.models[s] = model
+            self.pool = ThreadPoolExecutor(max_workers=len(self.shards) or 1, thread_name_prefix="vybe-shard")
+        elif mode == "process":
+            ctx = mp.get_context("spawn")
+            self.workers = {
+                s: ProcessPoolExecutor(max_workers=1, mp_context=ctx, initializer=_init_worker,
+                                       initargs=(shard_path(shards_dir, s), self.feature_dim, mmap))
+                for s in self.shards
+            }
+        else:
+            raise ValueError(f"Unknown mode '{mode}', expected 'thread' or 'process'")
+
+    # Raises if the shards were built with a different projection than the one
+    # queries are transformed with (signature from models.projection.projection_signature)
+    def check_projection(self, signature):
+        if "projection" in self.manifest and self.manifest["projection"] != signature:
+            built = self.manifest["projection"]
+            raise ValueError(
+                f"Shards in {self.shards_dir} were built with projection {_describe(built)}, "
+                f"but queries use {_describe(signature)}. Rebuild them with python -m utils.new_shards"
+            )
+
+    def __len__(self):
+        return sum(self.manifest["shards"][str(s)]["count"] for s in self.shards)
+
+    # Searches every shard for the k best matches of each query row and merges them.
+    # Returns one list of (filename, score) per query, best first.
+    def search(self, query_vectors: np.ndarray, k: int = 10):
+        Q = np.ascontiguousarray(query_vectors, dtype="float32")
+        if Q.ndim == 1:
+            Q = Q.reshape(1, -1)
+        if Q.shape[1] != self.feature_dim:
+            raise ValueError(
+                f"Queries have {Q.shape[1]} dims but the shards in {self.shards_dir} hold "
+                f"{self.feature_dim}-dim vectors (projection {_describe(self.manifest.get('projection'))}). "
+                f"The index was rebuilt since; rebuild the shards with python -m utils.new_shards"
+            )
+
+        if self.mode == "thread":
+            futures = [self.pool.submit(_search_loaded, self.models[s], Q, k) for s in self.shards]
+        else:
+            futures = [self.workers[s].submit(_worker_search, Q, k) for s in self.shards]
+
+        results = [f.result() for f in futures]
+        return merge_results([r[0] for r in results], [r[1] for r in results], k)
+
+    def close(self):
+        if self.mode == "thread":
+            self.pool.shutdown(wait=False)
+        else:
+            for pool in self.workers.values():
+                pool.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    # tests shard assignment and merging
+    assert shard_of("000002.mp3", n_shards=4) == shard_of("000002.mp3", n_shards=4)
+    a = shard_of("x.mp3", "data/raw/fma_small/000/000002.mp3", 16, "folder")
+    b = shard_of("y.mp3", "data/raw/fma_small/000/000005.mp3", 16, "folder")
+    assert a == b, "tracks in the same folder should share a shard"
+
+    D1 = np.array([[0.9, 0.5]], dtype="float32")
+    D2 = np.array([[0.7, -np.inf]], dtype="float32")
+    n1 = np.array([["a", "b"]], dtype=object)
+    n2 = np.array([["c", None]], dtype=object)
+    merged = merge_results([D1, D2], [n1, n2], k=3)
+    assert [name for name, _ in merged[0]] == ["a", "c", "b"]
+
+    # queries must match the width and projection the shards were built with
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        X = np.eye(4, dtype="float32")
+        build_shard(tmp, 0, ["a", "b", "c", "d"], X)
+        save_manifest(tmp, {"scheme": "hash", "n_shards": 1, "dim": 4, "projection": None,
+                            "shards": {"0": {"count": 4}}})
+        sharded = ShardedSearch(tmp, mmap=False)
+        assert sharded.search(X[0], k=1)[0][0][0] == "a"
+        for bad in (lambda: sharded.search(np.ones(8), k=1),
+                    lambda: sharded.check_projection({"kind": "pca", "d_in": 8, "dim": 4, "crc32": 0})):
+            try:
+                bad()
+                raise AssertionError("mismatched queries should be rejected")
+            except ValueError:
+                pass
+        sharded.check_projection(None)
+        sharded.close()
+
+    print("All tests passed.\n")
@@ -1,20 +1,124 @@
 import numpy as np
 import faiss
 import os
+from array import array
+
+# Flags for zero-copy index loading. IO_FLAG_MMAP_IFC maps flat and scalar
+# quantized codes straight from the file so worker processes share them
+# through the page cache; older faiss builds only know IO_FLAG_MMAP.
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+# Reads a FAISS index from disk, memory-mapping it when mmap=True.
+# Falls back to a normal read if this faiss build can't map the index type.
+def load_index(path: str, mmap: bool = True):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No FAISS index found at {path}")
+    if mmap:
+        try:
+            return faiss.read_index(path, MMAP_FLAGS)
+        except RuntimeError as e:
+            print(f"[WARN] Could not memory-map {path} ({e}), loading into memory instead")
+    return faiss.read_index(path)
+
+
+# Append-only table of interned strings, stored as one UTF-8 byte blob plus an
+# offsets array instead of one Python str (or one fixed-width unicode cell) per
+# entry. Loaded tables can be memory-mapped and are decoded only on lookup.
+class StringTable:
+    def __init__(self, blob=None, offsets=None):
+        self.blob = blob if blob is not None else bytearray()
+        self.offsets = offsets if offsets is not None else array("q", [0])
+        self._codes = None  # str -> code, only built once we start interning
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, code: int) -> str:
+        start, end = int(self.offsets[code]), int(self.offsets[code + 1])
+        return bytes(self.blob[start:end]).decode("utf-8")
+
+    # Returns the code for s, adding it to the table if it's new
+    def intern(self, s: str) -> int:
+        if self._codes is None:
+            # loaded tables are numpy arrays, switch to growable buffers
+            self.blob = bytearray(self.blob)
+            self.offsets = array("q", (int(o) for o in self.offsets))
+            self._codes = {self[i]: i for i in range(len(self))}
+
+        code = self._codes.get(s)
+        if code is None:
+            code = len(self)
+            self.blob += s.encode("utf-8")
+            self.offsets.append(len(self.blob))
+            self._codes[s] = code
+        return code
+
+    @classmethod
+    def from_strings(cls, strings):
+        table = cls()
+        codes = array("i", (table.intern(str(s)) for s in strings))
+        return table, codes
+
+    def save(self, prefix: str):
+        np.save(prefix + "_names.npy", np.frombuffer(bytes(self.blob), dtype=np.uint8))
+        np.save(prefix + "_name_offsets.npy", np.asarray(self.offsets, dtype=np.int64))
+
+    @classmethod
+    def load(cls, prefix: str, mmap: bool = False):
+        mode = "r" if mmap else None
+        return cls(np.load(prefix + "_names.npy", mmap_mode=mode),
+                   np.load(prefix + "_name_offsets.npy", mmap_mode=mode))
+
 
 class SimilaritySearch:
-    # Initializes a FAISS index for L2 (Euclidean) distance
-    def __init__(self, feature_dim: int):
+    # Initializes a FAISS index for L2 (Euclidean) distance, or inner product
+    # (cosine similarity on normalized vectors) with metric="ip"
+    def __init__(self, feature_dim: int, metric: str = "l2"):
         self.feature_dim = feature_dim
-        self.index = faiss.IndexFlatL2(feature_dim)
-        self.song_ids = [] 
+        if metric == "ip":
+            self.index = faiss.IndexFlatIP(feature_dim)
+        else:
+            self.index = faiss.IndexFlatL2(feature_dim)
+        # index position -> code in id_table
+        self.id_codes = array("i")
+        self.id_table = StringTable()
+        self.read_only = False
+
+    # All song ids in index order. Builds a full Python list, so prefer
+    # get_song_id for lookups on large indexes.
+    @property
+    def song_ids(self) -> list:
+        return [self.id_table[c] for c in self.id_codes]
+
+    def get_song_id(self, pos: int) -> str:
+        return self.id_table[int(self.id_codes[pos])]
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError("Index was loaded with mmap=True and is read-only; load it without mmap to add songs")
+
+    def _append_codes(self, codes):
+        if not isinstance(self.id_codes, array):  # loaded ids are numpy (maybe read-only)
+            self.id_codes = array("i", np.asarray(self.id_codes, dtype=np.int32).tobytes())
+        self.id_codes.extend(codes)
 
     # Adds a new song feature vector to the index
     def add_song(self, song_id: str, feature_vector: np.ndarray):
         if feature_vector.ndim == 1:
             feature_vector = feature_vector.reshape(1, -1)
+        self._check_writable()
         self.index.add(feature_vector.astype("float32"))
-        self.song_ids.append(song_id)
+        self._append_codes([self.id_table.intern(song_id)])
+
+    # Adds many songs with a single index.add call. matrix is (len(song_ids), feature_dim).
+    def add_songs(self, song_ids, matrix: np.ndarray):
+        self._check_writable()
+        matrix = np.ascontiguousarray(matrix, dtype="float32")
+        if matrix.ndim != 2 or matrix.shape[0] != len(song_ids):
+            raise ValueError(f"Expected a ({len(song_ids)}, {self.feature_dim}) matrix, got {matrix.shape}")
+        self.index.add(matrix)
+        self._append_codes([self.id_table.intern(s) for s in song_ids])
 
     # Searches for the k most similar songs to the given feature vector
     def search(self, query_vector: np.ndarray, k: int = 5):
@@ -24,21 +128,33 @@ class SimilaritySearch:
         distances, indices = self.index.search(query_vector.astype("float32"), k)
         results = []
         for i, dist in zip(indices[0], distances[0]):
-            if i < len(self.song_ids):
-                results.append((self.song_ids[i], dist))
+            if 0 <= i < len(self.id_codes):
+                results.append((self.get_song_id(i), dist))
         return results
 
-    # Saves the FAISS index and song metadata to disk.
+    # Saves the FAISS index and song metadata to disk. Ids are written as an
+    # int32 code array (_ids.npy) plus the string table (_names.npy, _name_offsets.npy).
     def save(self, path: str = "models/faiss_index.bin"):
         os.makedirs(os.path.dirname(path), exist_ok=True)
         faiss.write_index(self.index, path)
-        np.save(path.replace(".bin", "_ids.npy"), np.array(self.song_ids))
+        prefix = path.replace(".bin", "")
+        np.save(prefix + "_ids.npy", np.asarray(self.id_codes, dtype=np.int32))
+        self.id_table.save(prefix)
 
-    # Loads a FAISS index and song metadata from disk.
-    def load(self, path: str = "models/faiss_index.bin"):
+    # Loads a FAISS index and song metadata from disk. With mmap=True the index,
+    # id codes and string table are all memory-mapped read-only instead of copied.
+    def load(self, path: str = "models/faiss_index.bin", mmap: bool = False):
         if os.path.exists(path):
-            self.index = faiss.read_index(path)
-            self.song_ids = np.load(path.replace(".bin", "_ids.npy")).tolist()
+            self.index = load_index(path, mmap=mmap)
+            self.read_only = mmap
+            prefix = path.replace(".bin", "")
+            codes = np.load(prefix + "_ids.npy", mmap_mode="r" if mmap else None)
+            if codes.dtype.kind == "U":
+                # older saves stored the ids themselves as a fixed-width unicode array
+                self.id_table, self.id_codes = StringTable.from_strings(codes)
+            else:
+                self.id_codes = codes
+                self.id_table = StringTable.load(prefix, mmap=mmap)
         else:
             raise FileNotFoundError(f"No FAISS index found at {path}")
 
@@ -0,0 +1,255 @@
+"""
+Builds a radio-style playlist from several seed songs in one call.
+
+Seeds can be tracks already in the library (by filename or FMA track id), whose
+vectors are read back from the index with reconstruct, or audio files, which go
+through the normal clip + extract + scale path. All seeds are searched together
+in one batched FAISS call and their results are fused into a single ranking,
+skipping the seeds themselves and anything played recently.
+
+    python playlist.py 000002.mp3 5 "my song.mp3" --n 20 --fusion rrf --recent recent.txt
+"""
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+import faiss, joblib
+
+from features.backends import artifact_paths, get_backend
+from models.projection import load_projection, transform_vectors
+from models.similarity_search import load_index
+from query_backend import extract_query_vector
+from search import lookup_track_by_filename
+
+PROCESSED_DIR = "data/processed"
+
+# Feature backend (VYBE_BACKEND) decides which index and scaler are loaded
+BACKEND = get_backend()
+PATHS = artifact_paths(BACKEND, PROCESSED_DIR)
+INDEX_FILE = PATHS["index"]
+SCALER_FILE = PATHS["scaler"]
+PROJECTION_FILE = PATHS["projection"]
+MAPPING_FILE = PATHS["mapping"]
+LIBRARY_FILE = os.path.join(PROCESSED_DIR, "library.csv")
+
+MMAP_INDEX = os.environ.get("VYBE_MMAP_INDEX", "1") != "0"
+
+FUSIONS = ("rrf", "centroid", "max")
+RRF_K = 60  # standard reciprocal rank fusion constant, damps the weight of top ranks
+CANDIDATE_BUDGET = 200  # candidates shared between the query rows
+MAX_QUERY_ROWS = 8  # seeds beyond this are grouped, since a flat search scans the library once per row
+DUPLICATE_SIM = 0.995  # a hit this close to a seed is the seed itself (a copy, or a re-encode under another name)
+
+
+# Resolves library seeds (filenames or track ids) to index positions.
+# Returns the positions and the seeds that weren't found.
+def resolve_library_seeds(seeds, mapping: pd.DataFrame, lib: pd.DataFrame):
+    pos_by_file = dict(zip(mapping["filename"], mapping["index_pos"]))
+    file_by_tid = {}
+    if "track_id" in lib.columns:
+        known = lib.dropna(subset=["track_id"])
+        file_by_tid = dict(zip(known["track_id"].astype(int).astype(str), known["filename"]))
+
+    positions, missing = [], []
+    for seed in seeds:
+        fname = seed if seed in pos_by_file else file_by_tid.get(str(seed).lstrip("0") or "0")
+        if fname in pos_by_file:
+            positions.append(int(pos_by_file[fname]))
+        else:
+            missing.append(seed)
+    return positions, missing
+
+
+# Groups seed vectors into at most m representatives with a few rounds of spherical
+# k-means, seeded with the m most spread-out seeds. Returns the normalized
+# representatives and how many seeds each one stands for.
+def group_seeds(seed_vecs: np.ndarray, m: int = MAX_QUERY_ROWS, iters: int = 10):
+    X = np.ascontiguousarray(seed_vecs, dtype="float32")
+    if len(X) <= m:
+        return X, np.ones(len(X))
+
+    picks = [0]
+    closest = X @ X[0]
+    for _ in range(1, m):
+        picks.append(int(np.argmin(closest)))
+        closest = np.maximum(closest, X @ X[picks[-1]])
+    reps = X[picks].copy()
+
+    for _ in range(iters):
+        assign = np.argmax(X @ reps.T, axis=1)
+        for c in range(m):
+            members = X[assign == c]
+            if len(members):
+                reps[c] = members.mean(axis=0)
+        faiss.normalize_L2(reps)
+
+    assign = np.argmax(X @ reps.T, axis=1)
+    weights = np.bincount(assign, minlength=m).astype(np.float64)
+    keep = weights > 0
+    return np.ascontiguousarray(reps[keep]), weights[keep]
+
+
+# Fuses the results of several queries into one ranking.
+# D, I are (n_rows, k) arrays from one batched search, weights how many seeds each
+# row stands for (rrf only). Returns [(index_pos, score)].
+def fuse_results(D: np.ndarray, I: np.ndarray, fusion: str = "rrf", weights=None) -> list:
+    ranks = np.broadcast_to(np.arange(I.shape[1]), I.shape)
+    valid = I >= 0
+    positions, slot = np.unique(I[valid], return_inverse=True)
+
+    if fusion == "rrf":
+        w = np.ones(len(I)) if weights is None else np.asarray(weights, dtype=np.float64)
+        w = np.broadcast_to(w[:, None], I.shape)
+        scores = np.zeros(len(positions))
+        np.add.at(scores, slot, w[valid] / (RRF_K + ranks[valid] + 1))
+    else:  # max-sim, also used for the single centroid row
+        scores = np.full(len(positions), -np.inf)
+        np.maximum.at(scores, slot, D[valid].astype(np.float64))
+
+    order = np.argsort(-scores, kind="stable")
+    return [(int(positions[i]), float(scores[i])) for i in order]
+
+
+# Resolves audio file seeds that are also in the library (same filename) to index positions
+def resolve_file_seeds(paths, mapping: pd.DataFrame) -> list:
+    pos_by_file = dict(zip(mapping["filename"], mapping["index_pos"]))
+    names = (os.path.basename(p) for p in paths)
+    return [int(pos_by_file[name]) for name in names if name in pos_by_file]
+
+
+# Ranks library tracks against a set of seed vectors (already scaled + normalized).
+# "centroid" searches the mean of the seeds. "rrf" and "max" search each seed, or
+# with more than MAX_QUERY_ROWS seeds their grouped representatives, and fuse.
+# Seeds, exclude positions and tracks whose stored vector is near-identical to a
+# seed never appear in the result.
+def build_playlist(index, seed_vecs: np.ndarray, n: int = 20, fusion: str = "rrf",
+                   seed_positions=(), exclude_positions=(), budget: int = CANDIDATE_BUDGET) -> list:
+    if fusion not in FUSIONS:
+        raise ValueError(f"Unknown fusion '{fusion}', expected one of {FUSIONS}")
+
+    skip = set(seed_positions) | set(exclude_positions)
+    Q = np.ascontiguousarray(seed_vecs, dtype="float32")
+    weights = None
+
+    if fusion == "centroid":
+        Q = Q.mean(axis=0, keepdims=True)
+        faiss.normalize_L2(Q)
+    else:
+        Q, weights = group_seeds(Q)
+
+    # One batched search over at most MAX_QUERY_ROWS rows, so the library is scanned
+    # a bounded number of times however many seeds there are. Skipped tracks are
+    # filtered inside the search, so they don't cost extra depth.
+    params = None
+    if skip:
+        skip_sel = faiss.IDSelectorBatch(np.array(sorted(skip), dtype="int64"))
+        params = faiss.SearchParameters(sel=faiss.IDSelectorNot(skip_sel))
+    k = min(index.ntotal, max(n, budget // len(Q)))
+    D, I = index.search(Q, k, params=params)
+
+    playlist = [(pos, score) for pos, score in fuse_results(D, I, fusion, weights) if pos not in skip]
+    if playlist:
+        stored = index.reconstruct_batch(np.array([pos for pos, _ in playlist], dtype="int64"))
+        seed_sim = (stored @ np.asarray(seed_vecs, dtype="float32").T).max(axis=1)
+        playlist = [hit for hit, sim in zip(playlist, seed_sim) if sim < DUPLICATE_SIM]
+    return playlist[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a playlist from several seed songs")
+    parser.add_argument("seeds", nargs="+", help="library filenames, FMA track ids or audio file paths")
+    parser.add_argument("--n", type=int, default=20, help="playlist length")
+    parser.add_argument("--fusion", choices=FUSIONS, default="rrf")
+    parser.add_argument("--recent", help="text file of recently played filenames/track ids to exclude, one per line")
+    args = parser.parse_args()
+
+    index = load_index(INDEX_FILE, mmap=MMAP_INDEX)
+    scaler = joblib.load(SCALER_FILE)
+    projection = load_projection(PROJECTION_FILE)
+    mapping = pd.read_csv(MAPPING_FILE)
+    lib = pd.read_csv(LIBRARY_FILE)
+
+    # library seeds come straight from the stored vectors, anything else is treated as audio
+    seed_positions, others = resolve_library_seeds(args.seeds, mapping, lib)
+    vecs = []
+    if seed_positions:
+        vecs.append(index.reconstruct_batch(np.array(seed_positions, dtype="int64")))
+    file_seeds = []
+    for path in others:
+        if not os.path.exists(path):
+            print(f"Seed not found in library or on disk: {path}")
+            continue
+        file_seeds.append(path)
+        q_vec = extract_query_vector(path, backend_name=BACKEND.name)
+        if q_vec.size == 0:
+            print(f"Could not extract features from {path}")
+            continue
+        vecs.append(transform_vectors(q_vec, scaler, projection))
+
+    if not vecs:
+        print("No usable seeds")
+        return
+
+    exclude = []
+    if args.recent:
+        with open(args.recent) as f:
+            recent = [line.strip() for line in f if line.strip()]
+        exclude, _ = resolve_library_seeds(recent, mapping, lib)
+
+    # audio files that are also library tracks shouldn't come back as their own neighbours
+    seed_positions += resolve_file_seeds(file_seeds, mapping)
+
+    seed_vecs = np.vstack(vecs)
+    playlist = build_playlist(index, seed_vecs, n=args.n, fusion=args.fusion,
+                              seed_positions=seed_positions, exclude_positions=exclude)
+
+    file_by_pos = dict(zip(mapping["index_pos"], mapping["filename"]))
+    print(f"\nPlaylist from {len(seed_vecs)} seeds ({args.fusion}):")
+    for rank, (pos, score) in enumerate(playlist, start=1):
+        fname = file_by_pos.get(pos, str(pos))
+        tid, disp = lookup_track_by_filename(fname, lib)
+        print(f"{rank}. ID {tid if tid is not None else 'Not found'} | {disp}  (score: {score:.3f})")
+
+
+if __name__ == "__main__":
+    # tests fusion and exclusion on a toy index
+    X = np.eye(4, dtype="float32")
+    X[2] = [0.9, 0.1, 0, 0]
+    X[3] = [0.1, 0.9, 0, 0]
+    faiss.normalize_L2(X)
+    toy = faiss.IndexFlatIP(4)
+    toy.add(X)
+
+    for fusion in FUSIONS:
+        result = build_playlist(toy, X[[0, 1]], n=4, fusion=fusion, seed_positions=[0, 1])
+        positions = [pos for pos, _ in result]
+        assert 0 not in positions and 1 not in positions, f"{fusion} returned a seed"
+        assert set(positions) == {2, 3}, f"{fusion} missed a neighbour: {positions}"
+
+    result = build_playlist(toy, X[[0]], n=4, seed_positions=[0], exclude_positions=[2])
+    assert 2 not in [pos for pos, _ in result]
+
+    # an audio seed that isn't resolved to a position is still dropped by vector
+    for fusion in FUSIONS:
+        result = build_playlist(toy, X[[0]], n=4, fusion=fusion)
+        assert 0 not in [pos for pos, _ in result], f"{fusion} returned an unresolved seed"
+
+    toy_map = pd.DataFrame({"index_pos": [0, 1], "filename": ["000002.mp3", "x.mp3"]})
+    toy_lib = pd.DataFrame({"track_id": [2, None], "filename": ["000002.mp3", "x.mp3"]})
+    positions, missing = resolve_library_seeds(["2", "x.mp3", "nope.mp3"], toy_map, toy_lib)
+    assert positions == [0, 1] and missing == ["nope.mp3"]
+    assert resolve_file_seeds([os.path.join("data", "raw", "x.mp3"), "other.wav"], toy_map) == [1]
+
+    # many seeds are grouped into at most MAX_QUERY_ROWS query rows
+    rng = np.random.default_rng(0)
+    many = rng.standard_normal((50, 4)).astype("float32")
+    faiss.normalize_L2(many)
+    reps, weights = group_seeds(many)
+    assert len(reps) <= MAX_QUERY_ROWS and weights.sum() == 50
+    assert np.allclose(np.linalg.norm(reps, axis=1), 1.0, atol=1e-5)
+    assert len(build_playlist(toy, many, n=2)) == 2
+
+    print("All tests passed.\n")
+
+    main()
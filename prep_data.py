@@ -1,7 +1,8 @@
 """
 This file contains my original approach to preparing the fma_small dataset for similarity search.
 It extracts features from audio files, handles corrupted files by moving them to a separate directory,
-and builds a FAISS index for efficient similarity search.
+and builds a FAISS index for efficient similarity search. Extraction runs in isolated worker processes
+with per-file time and memory limits, and progress is checkpointed so an interrupted run resumes.
 """
 
 import os
@@ -10,14 +11,25 @@ import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
-from features.extract_features import extract_features
+from features.backends import artifact_paths, feature_dir, get_backend
 from models.similarity_search import SimilaritySearch
+from utils.ingest_runner import EMPTY, OK, CheckpointLog, run_isolated
 
 RAW_DIR = "data/raw"
 PROCESSED_DIR = "data/processed"
 BROKEN_DIR = "data/broken_raw"
-META_FILE = os.path.join(PROCESSED_DIR, "metadata.csv")
-INDEX_FILE = "models/faiss_index.bin"
+
+# Feature backend (VYBE_BACKEND) decides where features, metadata and the index live
+BACKEND = get_backend()
+PATHS = artifact_paths(BACKEND, PROCESSED_DIR)
+FEATURE_DIR = feature_dir(BACKEND, PROCESSED_DIR)
+META_FILE = PATHS["meta"]
+INDEX_FILE = PATHS["index"]
+CHECKPOINT_FILE = os.path.join(PROCESSED_DIR, f"ingest_checkpoint_{BACKEND.name}.jsonl")
+
+FILE_TIMEOUT = 120.0     # seconds before a file is treated as hung and moved to broken_raw
+MEMORY_LIMIT_MB = 2048   # per worker, on platforms that support address space limits
+CHECKPOINT_EVERY = 50    # files between flushes of the checkpoint log
 
 # Move a corrupted or unreadable file to data/broken_raw/, preserving subfolders
 def safe_move_to_broken(src_path):
@@ -34,6 +46,7 @@ def safe_move_to_broken(src_path):
 
 def main():
     os.makedirs(PROCESSED_DIR, exist_ok=True)
+    os.makedirs(FEATURE_DIR, exist_ok=True)
     os.makedirs(os.path.dirname(INDEX_FILE), exist_ok=True)
     os.makedirs(BROKEN_DIR, exist_ok=True)
 
@@ -48,60 +61,105 @@ def main():
         print("No audio files found in data/raw/")
         return
 
-    metadata = []
+    checkpoint = CheckpointLog(CHECKPOINT_FILE, BACKEND.tag)
+    done = checkpoint.done  # song path -> metadata row
+    broken = checkpoint.broken
+    if done or broken:
+        print(f"Resuming from checkpoint: {len(done)} done, {len(broken)} broken")
 
-    search_model = SimilaritySearch(feature_dim=51)
+    vectors = {}
 
-    for song_path in tqdm(songs, desc="Extracting features"):
+    def feature_path_for(song_path):
         file_name = os.path.basename(song_path)
-        feature_path = os.path.join(
-            PROCESSED_DIR,
+        return os.path.join(
+            FEATURE_DIR,
             file_name.replace(".mp3", ".npy").replace(".wav", ".npy").replace(".flac", ".npy"),
         )
 
-        # Skip if already processed
-        if os.path.exists(feature_path):
-            try:
-                vec = np.load(feature_path)
-            except Exception as e:
-                print(f"Corrupted feature file {feature_path}: {e}")
-                os.remove(feature_path)
-                continue
-        else:
-            try:
-                vec = extract_features(song_path)
-            except Exception as e:
-                print(f"Failed to process {song_path}: {e}")
-                safe_move_to_broken(song_path)
-                continue
-
-            if vec.size > 0:
-                np.save(feature_path, vec)
-            else:
-                print(f"Empty features, skipping {file_name}")
-                safe_move_to_broken(song_path)
-                continue
-
-        # Update FAISS feature dimension dynamically if first valid vector
-        if len(metadata) == 0:
-            search_model = SimilaritySearch(feature_dim=len(vec))
-
-        # Add to FAISS index
-        search_model.add_song(file_name, vec)
-
-        # Add metadata entry
-        metadata.append({
-            "filename": file_name,
-            "feature_path": os.path.basename(feature_path),
+    def record(song_path, vec):
+        vectors[song_path] = vec
+        checkpoint.record_done(song_path, {
+            "filename": os.path.basename(song_path),
+            "feature_path": os.path.relpath(feature_path_for(song_path), PROCESSED_DIR),
             "length": len(vec)
         })
 
-    # Save metadata
-    pd.DataFrame(metadata).to_csv(META_FILE, index=False)
+    # Files with cached features only need their metadata
+    pending = []
+    for song_path in tqdm(songs, desc="Checking cached features"):
+        if song_path in done or song_path in broken:
+            continue
+        feature_path = feature_path_for(song_path)
+        if not os.path.exists(feature_path):
+            pending.append(song_path)
+            continue
+        try:
+            record(song_path, np.load(feature_path))
+        except Exception as e:
+            print(f"Corrupted feature file {feature_path}: {e}")
+            os.remove(feature_path)
+            pending.append(song_path)
+    checkpoint.flush()
+
+    # Extract the rest in isolated workers, checkpointing as results come in
+    if pending:
+        print(f"Extracting {BACKEND.tag} features for {len(pending)} new files")
+        progress = tqdm(total=len(pending), desc="Extracting features")
+        since_checkpoint = 0
+
+        def on_result(song_path, status, payload):
+            nonlocal since_checkpoint
+            progress.update(1)
+            if status == OK:
+                np.save(feature_path_for(song_path), payload)
+                record(song_path, payload)
+            else:
+                if status == EMPTY:
+                    print(f"Empty features, skipping {os.path.basename(song_path)}")
+                else:
+                    print(f"Failed to process {song_path} ({status}): {payload}")
+                safe_move_to_broken(song_path)
+                checkpoint.record_broken(song_path)
+
+            since_checkpoint += 1
+            if since_checkpoint >= CHECKPOINT_EVERY:
+                checkpoint.flush()
+                since_checkpoint = 0
+
+        try:
+            run_isolated(pending, on_result, backend_name=BACKEND.name,
+                         timeout=FILE_TIMEOUT, memory_limit_mb=MEMORY_LIMIT_MB)
+        finally:
+            progress.close()
+            checkpoint.close()
+
+    # Metadata in the order the files were found, so reruns produce the same index
+    rows = [done[p] for p in songs if p in done]
+    pd.DataFrame(rows, columns=["filename", "feature_path", "length"]).to_csv(META_FILE, index=False)
+
+    # Add everything to the FAISS index in one go, sized to the extracted vectors
+    names, matrix = [], []
+    for song_path in songs:
+        if song_path not in done:
+            continue
+        vec = vectors.get(song_path)
+        if vec is None:  # finished in an earlier, interrupted run
+            vec = np.load(feature_path_for(song_path))
+        names.append(done[song_path]["filename"])
+        matrix.append(vec)
+
+    if matrix:
+        search_model = SimilaritySearch(feature_dim=len(matrix[0]))
+        search_model.add_songs(names, np.stack(matrix))
+    else:
+        search_model = SimilaritySearch(feature_dim=51)
 
     # Save FAISS index
     search_model.save(INDEX_FILE)
 
+    # Everything is on disk now, so the next run starts fresh
+    checkpoint.remove()
+
     print("\n Dataset complete and ready for use.")
 
 
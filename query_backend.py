@@ -0,0 +1,235 @@
+"""
+Execution backend for the Streamlit demo.
+
+Decoding and feature extraction are CPU heavy and hold the GIL, so they run in a
+shared process pool. The FAISS search releases the GIL and runs in a thread pool
+next to the index. Requests go through one asyncio event loop (on a background
+thread) that queues them, limits how many run at once and enforces a timeout,
+so every Streamlit session shares the same workers instead of competing inside
+the script thread.
+"""
+
+import asyncio
+import multiprocessing as mp
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+from features.backends import get_backend
+
+CLIP_DURATION = 30.0
+MAX_QUEUE = 32          # requests waiting or running before new ones are rejected
+REQUEST_TIMEOUT = 120.0  # seconds, including time spent queued
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# find the most energetic segment in the song and write it to out_path
+def select_smart_clip_to_path(query_path: str, out_path: str, duration: float = CLIP_DURATION) -> str:
+    y, sr = librosa.load(query_path, sr=None, mono=True)
+
+    total_len_sec = len(y) / sr
+    if total_len_sec <= duration:
+        sf.write(out_path, y, sr)
+        return out_path
+
+    hop_length = 512
+    frame_length = 2048
+    rms = librosa.feature.rms(
+        y=y,
+        frame_length=frame_length,
+        hop_length=hop_length
+    )[0]
+
+    frames = np.arange(len(rms))
+    times = librosa.frames_to_time(frames, sr=sr, hop_length=hop_length)
+
+    window_frames = int((duration * sr) / hop_length)
+    if window_frames <= 0 or window_frames > len(rms):
+        offset = max(0.0, (total_len_sec - duration) / 2.0)
+    else:
+        avg_rms = np.convolve(rms, np.ones(window_frames), mode="valid") / window_frames
+        best_frame = int(np.argmax(avg_rms))
+        offset = float(times[best_frame])
+        if offset + duration > total_len_sec:
+            offset = max(0.0, total_len_sec - duration)
+
+    y_clip, _ = librosa.load(query_path, sr=sr, mono=True, offset=offset, duration=duration)
+    sf.write(out_path, y_clip, sr)
+    return out_path
+
+
+# Decode + clip + extract for one query file. Runs inside a worker process, where
+# get_backend keeps the backend (and any model it loads) alive between queries.
+# Returns an empty array if no features could be extracted.
+def extract_query_vector(query_audio_path: str, duration: float = CLIP_DURATION, backend_name: str = None) -> np.ndarray:
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_clip:
+        clip_path = tmp_clip.name
+
+    try:
+        select_smart_clip_to_path(query_audio_path, clip_path, duration=duration)
+        q_vec = get_backend(backend_name).extract(clip_path)
+        if not isinstance(q_vec, np.ndarray):
+            return np.array([])
+        return q_vec
+    finally:
+        if os.path.exists(clip_path):
+            os.remove(clip_path)
+
+
+class QueryBackend:
+    # search_fn(q_vec, k, top_n) -> results runs on the search threads, so it can
+    # use the index and lookup tables already loaded in this process.
+    def __init__(self, search_fn, workers: int = None, search_threads: int = None,
+                 max_concurrent: int = None, max_queue: int = MAX_QUEUE,
+                 timeout: float = REQUEST_TIMEOUT, backend_name: str = None):
+        cores = os.cpu_count() or 1
+        self.search_fn = search_fn
+        self.backend_name = backend_name
+        self.max_queue = max_queue
+        self.timeout = timeout
+
+        # spawn rather than fork: the Streamlit server is multithreaded
+        self.process_pool = ProcessPoolExecutor(max_workers=workers or cores,
+                                                mp_context=mp.get_context("spawn"))
+        self.thread_pool = ThreadPoolExecutor(max_workers=search_threads or min(4, cores),
+                                              thread_name_prefix="vybe-search")
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="vybe-backend", daemon=True)
+        self._thread.start()
+
+        # the semaphore has to be created on the loop that uses it
+        limit = max_concurrent or workers or cores
+        self._slots = asyncio.run_coroutine_threadsafe(self._make_semaphore(limit), self._loop).result()
+        self._pending = 0
+        self._running = 0
+
+    @staticmethod
+    async def _make_semaphore(limit: int):
+        return asyncio.Semaphore(limit)
+
+    # number of requests accepted but not finished, and how many of them are running
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    # With delete_input the request owns query_audio_path and removes it once no
+    # worker can still be reading it, including after a timeout or cancellation.
+    async def _run(self, query_audio_path: str, k: int, top_n: int, delete_input: bool = False):
+        job = None
+        try:
+            async with self._slots:
+                self._running += 1
+                try:
+                    job = self.process_pool.submit(extract_query_vector, query_audio_path,
+                                                   CLIP_DURATION, self.backend_name)
+                    q_vec = await asyncio.wrap_future(job)
+                    if q_vec.size == 0:
+                        return []
+                    loop = asyncio.get_running_loop()
+                    return await loop.run_in_executor(self.thread_pool, self.search_fn, q_vec, k, top_n)
+                finally:
+                    self._running -= 1
+        finally:
+            if delete_input:
+                if job is None:
+                    _remove_file(query_audio_path)
+                else:
+                    # a cancelled request can leave the extraction running in its worker
+                    job.add_done_callback(lambda _: _remove_file(query_audio_path))
+
+    # Queues one query and returns its results. Raises QueueFullError if too many
+    # requests are already waiting and asyncio.TimeoutError if it takes longer than
+    # timeout (a worker that already started extracting still finishes in the background).
+    async def search(self, query_audio_path: str, k: int = 11, top_n: int = 5, timeout: float = None,
+                     delete_input: bool = False):
+        if self._pending >= self.max_queue:
+            if delete_input:
+                _remove_file(query_audio_path)
+            raise QueueFullError(f"Too many queued requests ({self._pending}), try again shortly")
+
+        self._pending += 1
+        try:
+            return await asyncio.wait_for(self._run(query_audio_path, k, top_n, delete_input),
+                                          timeout or self.timeout)
+        finally:
+            self._pending -= 1
+
+    # Thread-safe entry point for synchronous callers such as a Streamlit script.
+    # Returns a concurrent.futures.Future that can be polled, waited on or cancelled.
+    def submit(self, query_audio_path: str, k: int = 11, top_n: int = 5, timeout: float = None,
+               delete_input: bool = False):
+        return asyncio.run_coroutine_threadsafe(
+            self.search(query_audio_path, k, top_n, timeout, delete_input), self._loop)
+
+    def shutdown(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self.thread_pool.shutdown(wait=False)
+        self.process_pool.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    # tests queueing and timeouts with a fake search function
+    import time
+
+    def fake_search(q_vec, k, top_n):
+        return []
+
+    backend = QueryBackend(fake_search, workers=1, max_concurrent=1, max_queue=1, timeout=30)
+
+    async def slow_run(path, k, top_n, delete_input=False):
+        await asyncio.sleep(0.5)
+        return [path]
+
+    backend._run = slow_run
+    first = backend.submit("a.wav")
+    time.sleep(0.05)
+    try:
+        backend.submit("b.wav").result()
+        raise AssertionError("second request should be rejected while the queue is full")
+    except QueueFullError:
+        pass
+    assert first.result() == ["a.wav"]
+
+    try:
+        backend.submit("c.wav", timeout=0.1).result()
+        raise AssertionError("request should time out")
+    except (asyncio.TimeoutError, TimeoutError):
+        pass
+
+    backend.shutdown()
+
+    # an owned input file is removed even when the request is cancelled mid-extraction
+    backend = QueryBackend(fake_search, workers=1)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
+        tmp.write(b"not audio")
+    future = backend.submit(tmp.name, delete_input=True)
+    time.sleep(0.5)
+    future.cancel()
+    for _ in range(300):
+        if not os.path.exists(tmp.name):
+            break
+        time.sleep(0.1)
+    assert not os.path.exists(tmp.name), "owned input file was left behind"
+    backend.shutdown()
+    print("All tests passed.\n")
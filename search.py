@@ -2,18 +2,33 @@ import os
 import sys
 import numpy as np
 import pandas as pd
-import faiss, joblib
+import joblib
 import librosa
 import soundfile as sf
 
-from features.extract_features import extract_features
+from features.backends import artifact_paths, get_backend
+from models.projection import load_projection, projection_signature, transform_vectors
+from models.sharding import SHARDS_DIR, ShardedSearch
+from models.similarity_search import load_index
 
 PROCESSED_DIR = "data/processed"
-INDEX_FILE = "models/faiss_index.bin"
-SCALER_FILE = "models/feature_scaler.pkl"
-MAPPING_FILE = os.path.join(PROCESSED_DIR, "index_mapping.csv")
+
+# Feature backend (VYBE_BACKEND) decides which index and scaler are loaded
+BACKEND = get_backend()
+PATHS = artifact_paths(BACKEND, PROCESSED_DIR)
+INDEX_FILE = PATHS["index"]
+SCALER_FILE = PATHS["scaler"]
+PROJECTION_FILE = PATHS["projection"]
+MAPPING_FILE = PATHS["mapping"]
 LIBRARY_FILE = os.path.join(PROCESSED_DIR, "library.csv")
 
+# Memory-map the index so several worker processes share one copy (set VYBE_MMAP_INDEX=0 to disable)
+MMAP_INDEX = os.environ.get("VYBE_MMAP_INDEX", "1") != "0"
+
+# Search the sharded index built by utils/new_shards.py instead (set VYBE_SHARDED=1)
+USE_SHARDS = os.environ.get("VYBE_SHARDED", "0") == "1"
+BACKEND_SHARDS_DIR = os.path.join(SHARDS_DIR, BACKEND.name)
+
 CLIP_DURATION = 30.0  # seconds for the smart clip
 TEMP_CLIP_PATH = "temp_query_clip.wav"
 
@@ -107,25 +122,23 @@ def main():
         print(f"File not found: {query_path}")
         return
 
-    index = faiss.read_index(INDEX_FILE)
+    index = None if USE_SHARDS else load_index(INDEX_FILE, mmap=MMAP_INDEX)
     scaler = joblib.load(SCALER_FILE)
+    projection = load_projection(PROJECTION_FILE)
     mapping = pd.read_csv(MAPPING_FILE)      
     lib = pd.read_csv(LIBRARY_FILE)          
 
     temp_clip = select_smart_clip(query_path, duration=CLIP_DURATION)
 
-    q_vec = extract_features(temp_clip)
+    q_vec = BACKEND.extract(temp_clip)
     if not isinstance(q_vec, np.ndarray) or q_vec.size == 0:
         # Clean up temp file
         if os.path.exists(TEMP_CLIP_PATH):
             os.remove(TEMP_CLIP_PATH)
         return
 
-    q_vec = q_vec.astype("float32").reshape(1, -1)
-
-    # scale + normalize using dataset scaler
-    q_vec = scaler.transform(q_vec).astype("float32")
-    faiss.normalize_L2(q_vec)
+    # scale, project + normalize the same way the index was built
+    q_vec = transform_vectors(q_vec, scaler, projection)
 
     # cherry_vec, cherry_disp = get_cherry_vector_by_filename(index, mapping, lib)
     # if cherry_vec is not None:
@@ -134,17 +147,23 @@ def main():
     #     print(f"  {cherry_disp}  (cosine similarity: {sim:.3f})")
 
     k = 11
-    D, I = index.search(q_vec, k)
+    if USE_SHARDS:
+        sharded = ShardedSearch(BACKEND_SHARDS_DIR, mode="thread", mmap=MMAP_INDEX)
+        sharded.check_projection(projection_signature(PROJECTION_FILE))
+        hits = sharded.search(q_vec, k)[0]
+        sharded.close()
+    else:
+        D, I = index.search(q_vec, k)
+        hits = []
+        for idx, score in zip(I[0], D[0]):
+            hit = mapping.loc[mapping["index_pos"] == idx]
+            if not hit.empty:
+                hits.append((hit.iloc[0]["filename"], score))
 
     print("\nTop similar songs in your library:")
 
     shown = 0
-    for idx, score in zip(I[0], D[0]):
-        hit = mapping.loc[mapping["index_pos"] == idx]
-        if hit.empty:
-            continue
-        hit = hit.iloc[0]
-        fname = hit["filename"]
+    for fname, score in hits:
         tid, disp = lookup_track_by_filename(fname, lib)
         print(f"{shown+1}. ID {tid if tid is not None else 'Not found'} | {disp}  (similarity: {score:.3f})")
         shown += 1
@@ -0,0 +1,324 @@
+"""
+Fault-isolated feature extraction for ingest.
+
+Files are extracted in a pool of long-lived worker processes, one per core. Each
+worker loads the feature backend (and its model) once and then takes small groups
+of paths, which go through the backend's batched extract_many. A group gets the
+wall-clock limit of a single file and, where the OS supports it, the worker runs
+under an address space limit. A group that hangs, crashes or raises is retried one
+file at a time, so only the file actually at fault is reported as broken. Workers
+are only replaced after they were killed or ran out of memory.
+
+Progress is appended to a JSON-lines checkpoint log, one line per finished or
+broken file, so checkpointing costs the same at 100k tracks as at 100 and an
+interrupted run can pick up where it stopped.
+"""
+
+import json
+import os
+import time
+from collections import deque
+import multiprocessing as mp
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from features.backends import get_backend
+
+try:
+    import resource
+except ImportError:  # Windows: no address space limits, timeouts still apply
+    resource = None
+
+FILE_TIMEOUT = 120.0      # seconds per file, and per group (a hang shows up within one file's limit)
+GROUP_SIZE = 8            # paths per extract_many call
+MEMORY_LIMIT_MB = 2048    # extra address space a worker may map, None to disable
+
+# statuses passed to on_result
+OK, EMPTY, FAILED, TIMEOUT, CRASHED = "ok", "empty", "failed", "timeout", "crashed"
+_OUT_OF_MEMORY = "oom"  # sent by a worker that is about to exit, reported as FAILED
+
+
+def _limit_memory(limit_mb):
+    if resource is None or not limit_mb:
+        return
+    # the limit is on top of what the worker already has mapped (a forked
+    # worker starts with the parent's whole address space)
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        current = 0
+    limit = current + int(limit_mb * 2**20)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+# Worker loop: loads the backend once, then extracts groups of paths sent by the
+# parent until it gets None. After a MemoryError the worker reports it and exits, since
+# its heap can't be trusted any more, and the parent starts a new one.
+def _worker(conn, backend_name, memory_limit_mb):
+    _limit_memory(memory_limit_mb)
+    backend = get_backend(backend_name)
+    try:
+        while True:
+            try:
+                group = conn.recv()
+            except EOFError:
+                break
+            if group is None:
+                break
+            try:
+                if len(group) == 1:
+                    vectors = [backend.extract(group[0])]
+                else:
+                    vectors = backend.extract_many(group)
+                conn.send((OK, [np.asarray(v, dtype=np.float32) for v in vectors]))
+            except MemoryError:
+                conn.send((_OUT_OF_MEMORY, f"exceeded the {memory_limit_mb} MB memory limit"))
+                break
+            except Exception as e:
+                conn.send((FAILED, f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def _context():
+    # fork is cheap because librosa is already imported; spawn elsewhere
+    methods = mp.get_all_start_methods()
+    return mp.get_context("fork" if "fork" in methods else "spawn")
+
+
+# Extracts features for every path in isolated workers and calls
+# on_result(path, status, vector_or_error) once per path, in completion order.
+def run_isolated(paths, on_result, backend_name: str = None, workers: int = None,
+                 group_size: int = GROUP_SIZE, timeout: float = FILE_TIMEOUT,
+                 memory_limit_mb: float = MEMORY_LIMIT_MB):
+    ctx = _context()
+    paths = list(paths)
+    jobs = deque(paths[i:i + group_size] for i in range(0, len(paths), group_size))
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    idle = []  # (process, connection) waiting for a group
+    busy = {}  # connection -> (process, group, deadline)
+
+    def spawn():
+        conn, child_conn = ctx.Pipe()
+        proc = ctx.Process(target=_worker, args=(child_conn, backend_name, memory_limit_mb), daemon=True)
+        proc.start()
+        child_conn.close()
+        return proc, conn
+
+    def retire(proc, conn):
+        conn.close()
+        proc.join(timeout=1)
+        if proc.is_alive():
+            proc.kill()
+            proc.join()
+
+    def report(group, status, payload):
+        if status == OK:
+            for path, vec in zip(group, payload):
+                on_result(path, OK if vec.size > 0 else EMPTY, vec)
+        elif len(group) > 1:
+            # don't know which file caused it, so retry each on its own
+            print(f"[WARN] group of {len(group)} files {status} ({payload}), retrying one at a time")
+            jobs.extendleft([p] for p in reversed(group))
+        else:
+            on_result(group[0], status, payload)
+
+    try:
+        idle.extend(spawn() for _ in range(workers))
+
+        while jobs or busy:
+            while jobs and idle:
+                proc, conn = idle.pop()
+                group = jobs.popleft()
+                conn.send(group)
+                busy[conn] = (proc, group, time.monotonic() + timeout)
+
+            next_deadline = min(deadline for _, _, deadline in busy.values())
+            ready = wait(list(busy), timeout=max(0.0, next_deadline - time.monotonic()))
+
+            for conn in ready:
+                proc, group, _ = busy.pop(conn)
+                try:
+                    status, payload = conn.recv()
+                except EOFError:
+                    # worker died without reporting, e.g. a segfault or the OOM killer
+                    retire(proc, conn)
+                    report(group, CRASHED, f"worker exited with code {proc.exitcode}")
+                    if jobs:
+                        idle.append(spawn())
+                    continue
+                if status == _OUT_OF_MEMORY:
+                    retire(proc, conn)
+                    status = FAILED
+                    if jobs:
+                        idle.append(spawn())
+                else:
+                    idle.append((proc, conn))
+                report(group, status, payload)
+
+            now = time.monotonic()
+            for conn in [c for c, (_, _, deadline) in busy.items() if deadline <= now]:
+                proc, group, _ = busy.pop(conn)
+                proc.kill()
+                retire(proc, conn)
+                report(group, TIMEOUT, f"no result after {timeout:g} s")
+                if jobs:
+                    idle.append(spawn())
+    finally:
+        for proc, conn in idle:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            retire(proc, conn)
+        for conn, (proc, _, _) in busy.items():
+            proc.kill()
+            retire(proc, conn)
+
+
+# Append-only checkpoint for one backend. The first line names the backend, every
+# other line is {"path": ..., "row": {...}} for a finished file or
+# {"path": ..., "broken": true}. Lines are buffered and only hit the disk on flush(),
+# and a line cut off by a crash is ignored on the next load.
+class CheckpointLog:
+    def __init__(self, path: str, backend_tag: str):
+        self.path = path
+        self.backend_tag = backend_tag
+        self.done = {}      # source path -> metadata row
+        self.broken = set()
+        self._cut_off = False
+
+        if self._load():
+            self._file = open(path, "a")
+            if self._cut_off:
+                self._file.write("\n")  # don't glue the next entry onto the partial line
+        else:
+            self.done, self.broken = {}, set()
+            self._file = open(path, "w")
+            self._write({"backend": backend_tag})
+            self.flush()
+
+    # Returns False if there's no usable checkpoint for this backend
+    def _load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path) as f:
+                text = f.read()
+            lines = text.splitlines()
+            self._cut_off = not text.endswith("\n")
+            header = json.loads(lines[0]) if lines else {}
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Ignoring unreadable checkpoint {self.path}: {e}")
+            return False
+        if header.get("backend") != self.backend_tag:
+            print(f"[WARN] Checkpoint {self.path} is for {header.get('backend')}, starting over")
+            return False
+
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # partial last line from an interrupted write
+            if entry.get("broken"):
+                self.broken.add(entry["path"])
+            else:
+                self.done[entry["path"]] = entry["row"]
+        return True
+
+    def _write(self, entry: dict):
+        self._file.write(json.dumps(entry) + "\n")
+
+    def record_done(self, path: str, row: dict):
+        self.done[path] = row
+        self._write({"path": path, "row": row})
+
+    def record_broken(self, path: str):
+        self.broken.add(path)
+        self._write({"path": path, "broken": True})
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    # Called once the run's results are written out for good
+    def remove(self):
+        self._file.close()
+        os.remove(self.path)
+
+
+if __name__ == "__main__":
+    # tests timeouts and crash handling with a fake backend
+    import tempfile
+    from features import backends
+
+    class FakeBackend(backends.FeatureBackend):
+        name = "fake"
+
+        def extract(self, file_path):
+            if "hang" in file_path:
+                time.sleep(60)
+            if "crash" in file_path:
+                os._exit(3)
+            if "huge" in file_path:
+                raise MemoryError
+            if "empty" in file_path:
+                return np.array([])
+            return np.full(4, os.getpid(), dtype=np.float32)
+
+        def extract_many(self, file_paths):
+            vectors = [self.extract(p) for p in file_paths]
+            for v in vectors:
+                if v.size:
+                    v[1] = len(file_paths)  # group size, to check batching
+            return vectors
+
+    backends.BACKENDS["fake"] = FakeBackend
+    results = {}
+    run_isolated(["a.mp3", "hang.mp3", "crash.mp3", "huge.mp3", "empty.mp3", "b.mp3"],
+                 lambda p, status, payload: results.__setitem__(p, status),
+                 backend_name="fake", workers=2, group_size=3, timeout=1.0)
+    assert results == {"a.mp3": OK, "b.mp3": OK, "hang.mp3": TIMEOUT, "crash.mp3": CRASHED,
+                       "huge.mp3": FAILED, "empty.mp3": EMPTY}, results
+
+    # healthy workers are reused, so the backend is only set up once per worker,
+    # and files reach it in groups through extract_many
+    pids, sizes = set(), set()
+
+    def on_vector(path, status, payload):
+        pids.add(int(payload[0]))
+        sizes.add(int(payload[1]))
+
+    run_isolated([f"{i}.mp3" for i in range(12)], on_vector,
+                 backend_name="fake", workers=2, group_size=4, timeout=5.0)
+    assert len(pids) == 2 and sizes == {4}, (pids, sizes)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ckpt_path = os.path.join(tmp, "ckpt.jsonl")
+        log = CheckpointLog(ckpt_path, "fake-v")
+        log.record_done("a.mp3", {"filename": "a.mp3"})
+        log.record_broken("b.mp3")
+        log.close()
+        with open(ckpt_path, "a") as f:
+            f.write('{"path": "c.mp3", "ro')  # interrupted mid-line
+
+        log = CheckpointLog(ckpt_path, "fake-v")
+        assert list(log.done) == ["a.mp3"] and log.broken == {"b.mp3"}
+        log.record_done("c.mp3", {"filename": "c.mp3"})
+        log.close()
+        log = CheckpointLog(ckpt_path, "fake-v")
+        assert list(log.done) == ["a.mp3", "c.mp3"]
+        log.close()
+        log = CheckpointLog(ckpt_path, "other-v")
+        assert log.done == {} and not log.broken
+        log.remove()
+        assert not os.path.exists(ckpt_path)
+
+    print("All tests passed.\n")
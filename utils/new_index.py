@@ -1,21 +1,37 @@
 import os
+import argparse
 import numpy as np
 import pandas as pd
 from sklearn.preprocessing import StandardScaler
 import faiss, joblib
 
+from features.backends import artifact_paths, get_backend
+from models.projection import PROJECTION_KINDS, fit_projection, projection_report, save_projection, transform_vectors
+from models.quantization import INDEX_KINDS, build_index, choose_index_kind, index_bytes, metadata_bytes, quantization_report
+
 PROCESSED_DIR = "data/processed"
-META_FILE = os.path.join(PROCESSED_DIR, "metadata.csv")
-INDEX_FILE = "models/faiss_index.bin"
-SCALER_FILE = "models/feature_scaler.pkl"
-MAPPING_FILE = os.path.join(PROCESSED_DIR, "index_mapping.csv")
 
+# Feature backend (VYBE_BACKEND) decides which artifacts are read and written
+BACKEND = get_backend()
+PATHS = artifact_paths(BACKEND, PROCESSED_DIR)
+META_FILE = PATHS["meta"]
+INDEX_FILE = PATHS["index"]
+SCALER_FILE = PATHS["scaler"]
+MAPPING_FILE = PATHS["mapping"]
+PROJECTION_FILE = PATHS["projection"]
+LIBRARY_FILE = os.path.join(PROCESSED_DIR, "library.csv")
 
-def main():
-    os.makedirs(os.path.dirname(INDEX_FILE), exist_ok=True)
+INDEX_TYPE = "flat"        # flat (float32), fp16, int8, or auto
+MEMORY_BUDGET_MB = None    # used by INDEX_TYPE="auto" to pick the most precise kind that fits
+REPLICAS = 1               # serving processes that each load the index and metadata within that budget
 
-    meta = pd.read_csv(META_FILE)
+PROJECTION = None          # None, pca, pca-whiten or opq
+PROJECTION_DIM = 32
 
+
+# Loads the cached feature vector for every metadata row, skipping missing or
+# unreadable files. Returns the kept rows (re-numbered) and the stacked matrix.
+def load_feature_vectors(meta: pd.DataFrame):
     vectors = []
     kept_rows = []
 
@@ -37,25 +53,63 @@ def main():
         kept_rows.append(row)
 
     if not vectors:
-        print("No vectors loaded")
-        return
+        return pd.DataFrame(columns=meta.columns), None
 
     meta_new = pd.DataFrame(kept_rows).reset_index(drop=True)
     X = np.stack(vectors).astype("float32")
+    return meta_new, X
 
-    # Standardize then L2-normalize for cosine similarity 
-    scaler = StandardScaler(with_mean=True, with_std=True).fit(X)
-    Xz = scaler.transform(X).astype("float32")
-    faiss.normalize_L2(Xz)
 
-    index = faiss.IndexFlatIP(Xz.shape[1])
-    index.add(Xz)
+def main(index_type: str = INDEX_TYPE, memory_budget_mb: float = MEMORY_BUDGET_MB, report: bool = False,
+         projection: str = PROJECTION, projection_dim: int = PROJECTION_DIM, projection_dims=None,
+         replicas: int = REPLICAS):
+    os.makedirs(os.path.dirname(INDEX_FILE), exist_ok=True)
+
+    meta = pd.read_csv(META_FILE)
+
+    meta_new, X = load_feature_vectors(meta)
+    if X is None:
+        print("No vectors loaded")
+        return
+
+    # Standardize, optionally project, then L2-normalize for cosine similarity
+    scaler = StandardScaler(with_mean=True, with_std=True).fit(X)
+    Xs = scaler.transform(X).astype("float32")
+
+    if projection_dims:
+        print(f"\nExplained variance vs recall for {projection or 'pca'}:")
+        print(projection_report(Xs, projection_dims, projection or "pca").to_string(index=False))
+
+    vt = fit_projection(Xs, projection, projection_dim) if projection else None
+    Xz = transform_vectors(X, scaler, vt)
+
+    if index_type == "auto":
+        if memory_budget_mb is None:
+            raise ValueError("index_type='auto' needs a memory budget")
+        # each replica also holds the index mapping and the library metadata
+        frames = [meta_new[["filename", "feature_path"]]]
+        if os.path.exists(LIBRARY_FILE):
+            frames.append(pd.read_csv(LIBRARY_FILE))
+        extra = metadata_bytes(*frames)
+        index_type = choose_index_kind(Xz.shape[0], Xz.shape[1], int(memory_budget_mb * 2**20),
+                                       replicas=replicas, extra_bytes=extra)
+        print(f"Chose {index_type} index for a {memory_budget_mb} MB budget "
+              f"({replicas} replica(s), {extra / 2**20:.1f} MB metadata each)")
+
+    index = build_index(Xz, index_type)
 
     faiss.write_index(index, INDEX_FILE)
     joblib.dump(scaler, SCALER_FILE)
-    print(f"Saved index: {INDEX_FILE}")
+    print(f"Saved {index_type} index ({index_bytes(index) / 2**20:.2f} MB): {INDEX_FILE}")
     print(f"Saved scaler: {SCALER_FILE}")
 
+    # the query path applies whatever projection file exists, so a stale one must go
+    if vt is not None:
+        save_projection(vt, PROJECTION_FILE)
+        print(f"Saved {projection} projection ({X.shape[1]} -> {projection_dim} dims): {PROJECTION_FILE}")
+    elif os.path.exists(PROJECTION_FILE):
+        os.remove(PROJECTION_FILE)
+
     # Save mapping from FAISS index position to filename / feature_path
     meta_new["index_pos"] = meta_new.index
     meta_new.to_csv(META_FILE, index=False)           
@@ -64,6 +118,10 @@ def main():
     )
     print(f"Saved index mapping: {MAPPING_FILE}")
 
+    if report:
+        print("\nMemory use and similarity error vs float32:")
+        print(quantization_report(Xz).to_string(index=False))
+
 
 if __name__ == "__main__":
     # tests index mapping logic
@@ -79,4 +137,17 @@ if __name__ == "__main__":
 
     print("All tests passed.\n")
 
-    main()
+    parser = argparse.ArgumentParser(description="Build the FAISS index from extracted features")
+    parser.add_argument("--index-type", choices=list(INDEX_KINDS) + ["auto"], default=INDEX_TYPE)
+    parser.add_argument("--memory-budget-mb", type=float, default=MEMORY_BUDGET_MB,
+                        help="total memory for all replicas, each holding the index and metadata")
+    parser.add_argument("--replicas", type=int, default=REPLICAS, help="serving processes sharing the budget")
+    parser.add_argument("--report", action="store_true", help="compare every index kind against float32")
+    parser.add_argument("--projection", choices=PROJECTION_KINDS, default=PROJECTION)
+    parser.add_argument("--dim", type=int, default=PROJECTION_DIM, help="output dimension of the projection")
+    parser.add_argument("--projection-report", type=int, nargs="+", metavar="DIM",
+                        help="print explained variance and recall for these dimensions")
+    args = parser.parse_args()
+
+    main(args.index_type, args.memory_budget_mb, args.report, args.projection, args.dim, args.projection_report,
+         args.replicas)
@@ -0,0 +1,98 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+import joblib
+
+from features.backends import artifact_paths, get_backend
+from models.projection import load_projection, projection_signature, transform_vectors
+from models.sharding import SCHEMES, SHARDS_DIR, build_shard, load_manifest, save_manifest, shard_of
+from utils.new_index import load_feature_vectors
+
+PROCESSED_DIR = "data/processed"
+LIBRARY_FILE = os.path.join(PROCESSED_DIR, "library.csv")
+
+# Feature backend (VYBE_BACKEND) decides which features are sharded and where they go
+BACKEND = get_backend()
+PATHS = artifact_paths(BACKEND, PROCESSED_DIR)
+META_FILE = PATHS["meta"]
+SCALER_FILE = PATHS["scaler"]
+PROJECTION_FILE = PATHS["projection"]
+BACKEND_SHARDS_DIR = os.path.join(SHARDS_DIR, BACKEND.name)
+
+N_SHARDS = 8
+SCHEME = "hash"  # or "folder" to keep each FMA folder together
+
+
+# Builds all shards, or only the ones listed in `only`. A partial rebuild reuses the
+# existing manifest's layout so unchanged shards stay valid.
+def main(n_shards: int = N_SHARDS, scheme: str = SCHEME, only=None):
+    if only:
+        manifest = load_manifest(BACKEND_SHARDS_DIR)
+        if manifest["n_shards"] != n_shards or manifest["scheme"] != scheme:
+            print(f"Using existing layout: {manifest['n_shards']} shards by {manifest['scheme']}")
+        n_shards, scheme = manifest["n_shards"], manifest["scheme"]
+    else:
+        manifest = {"backend": BACKEND.tag, "scheme": scheme, "n_shards": n_shards, "shards": {}}
+
+    meta = pd.read_csv(META_FILE)
+    meta, X = load_feature_vectors(meta)
+    if X is None:
+        print("No vectors loaded")
+        return
+
+    # rel_path comes from the library, tracks missing there fall back to hashing the filename
+    if os.path.exists(LIBRARY_FILE):
+        lib = pd.read_csv(LIBRARY_FILE, usecols=["filename", "rel_path"]).drop_duplicates("filename")
+        rel_paths = meta[["filename"]].merge(lib, on="filename", how="left")["rel_path"]
+    else:
+        rel_paths = pd.Series([None] * len(meta))
+
+    shard_ids = np.array([
+        shard_of(fname, rel, n_shards, scheme) for fname, rel in zip(meta["filename"], rel_paths)
+    ])
+
+    # Every shard has to use the same scaler (and projection) as the single index so scores are comparable
+    if os.path.exists(SCALER_FILE):
+        scaler = joblib.load(SCALER_FILE)
+    else:
+        scaler = StandardScaler(with_mean=True, with_std=True).fit(X)
+        joblib.dump(scaler, SCALER_FILE)
+        print(f"Saved scaler: {SCALER_FILE}")
+
+    # a partial rebuild can't mix shards built with different projections
+    signature = projection_signature(PROJECTION_FILE)
+    if only and manifest.get("projection", signature) != signature:
+        raise ValueError("The projection changed since the shards were built, rebuild all of them (drop --shards)")
+
+    Xz = transform_vectors(X, scaler, load_projection(PROJECTION_FILE))
+    manifest["dim"] = int(Xz.shape[1])
+    manifest["projection"] = signature
+
+    for shard in range(n_shards):
+        if only and shard not in only:
+            continue
+        rows = np.flatnonzero(shard_ids == shard)
+        count = build_shard(BACKEND_SHARDS_DIR, shard, meta["filename"].iloc[rows].tolist(), Xz[rows])
+        manifest["shards"][str(shard)] = {"count": count}
+        print(f"Built shard {shard} with {count} tracks")
+
+    save_manifest(BACKEND_SHARDS_DIR, manifest)
+    print(f"Saved shard manifest: {BACKEND_SHARDS_DIR}")
+
+
+if __name__ == "__main__":
+    # tests shard assignment covers every shard number in range
+    seen = {shard_of(f"{i:06d}.mp3", n_shards=4) for i in range(200)}
+    assert seen == {0, 1, 2, 3}
+
+    print("All tests passed.\n")
+
+    parser = argparse.ArgumentParser(description="Build the sharded FAISS index from extracted features")
+    parser.add_argument("--n-shards", type=int, default=N_SHARDS)
+    parser.add_argument("--scheme", choices=SCHEMES, default=SCHEME)
+    parser.add_argument("--shards", type=int, nargs="*", help="only rebuild these shard numbers")
+    args = parser.parse_args()
+
+    main(args.n_shards, args.scheme, args.shards)